@@ -18,12 +18,54 @@
 """
 A pure Python implementation of the Skein hash function and Threefish
 tweakable block cipher. It also includes a pseudo-random number
-generator based on Skein, and Cipher-Block Chaining (CBC) based
-functionality for encrypting variable-length data.
+generator based on Skein, and Cipher-Block Chaining (CBC) and counter
+(CTR) mode based functionality for encrypting variable-length data,
+and hashlib-style objects for Skein-256, Skein-512 and Skein-1024,
+from ``new``.
 """
 
 from __future__ import absolute_import
 
 from .threefish import (bytes2words, Threefish512, words2bytes)
-from .skein import (Skein512, Skein512Random)
-from .geesefly import (compress_encrypt_auth, encrypt)
+from .skein import (hash_file, Skein512, Skein512Output, Skein512Random,
+                    Skein512SharedRandom, Skein512Tree, skein512_many,
+                    SkeinRandom)
+import sys
+
+# The encryption functions pull in zlib and more, and are not needed
+# just to hash something with Skein512, so where Python allows it they
+# (and the hashlib-style objects) are only imported on first use.
+_lazy_names = dict((name, 'geesefly') for name in (
+    'AuthDecryptor', 'AuthEncryptor', 'AuthenticationError', 'Cipher',
+    'compress_encrypt_auth', 'compress_encrypt_auth_file',
+    'decrypt_ctr_range', 'Decryptor', 'encrypt', 'encrypt_ctr',
+    'encrypt_file', 'Encryptor'))
+_lazy_names.update((name, 'hashes') for name in (
+    'new', 'Skein256Hash', 'Skein512Hash', 'Skein1024Hash'))
+
+# A star import lists the lazy names too, and so loads them on demand
+__all__ = ['bytes2words', 'hash_file', 'Skein512', 'Skein512Output',
+           'Skein512Random', 'Skein512SharedRandom', 'Skein512Tree',
+           'skein512_many', 'SkeinRandom', 'Threefish512', 'words2bytes']
+__all__.extend(sorted(_lazy_names))
+
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _lazy_names:
+            raise AttributeError("module %r has no attribute %r"
+                                 % (__name__, name))
+        from importlib import import_module
+        value = getattr(import_module('.' + _lazy_names[name], __name__),
+                        name)
+        globals()[name] = value
+        return value
+
+    def __dir__():
+        return sorted(set(globals()) | set(_lazy_names))
+else:
+    from .geesefly import (AuthDecryptor, AuthEncryptor, AuthenticationError,
+                           Cipher, compress_encrypt_auth,
+                           compress_encrypt_auth_file, decrypt_ctr_range,
+                           Decryptor, encrypt, encrypt_ctr, encrypt_file,
+                           Encryptor)
+    from .hashes import new, Skein256Hash, Skein512Hash, Skein1024Hash
@@ -0,0 +1,422 @@
+# /usr/bin/env python
+# coding=utf-8
+
+#  Copyright 2010 Jonathan Bowman
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+#  implied. See the License for the specific language governing
+#  permissions and limitations under the License.
+
+"""Interchangeable implementations of the Threefish block functions
+
+A backend is chosen separately for each kind of operation: "single",
+for encrypting or decrypting one block at a time, and "bulk", for many
+independent blocks under the same key (CBC decryption, counter mode and
+Skein output). The choice comes from ``set_backend``, or else from the
+``GEESEFLY_BACKEND`` environment variable, which holds either a backend
+name, ``auto``, or a list like ``single=unrolled,bulk=numpy``, where
+operations left out keep their default. ``auto`` runs ``calibrate``,
+which times every available backend and caches the choice on disk. A
+backend that is unknown or not available on this system is replaced by
+a pure Python one.
+
+"""
+
+from __future__ import absolute_import
+
+import os
+
+from .util import izip, max64, words_format, xrange, zero_bytes
+
+try:
+    from collections import OrderedDict
+except ImportError: # Python 2.6
+    OrderedDict = dict
+
+OPERATIONS = ('single', 'bulk')
+
+empty_bytes = zero_bytes[:0]
+
+class Backend(object):
+    """A set of Threefish block functions.
+
+    `encrypt_block` and `decrypt_block` take the flat tuple of 152
+    subkey words from a ``KeySchedule`` and a list of 8 words, returning
+    a list of 8 words. `encrypt_blocks` and `decrypt_blocks` take the
+    subkeys and a bytestring whose length is a multiple of 64, returning
+    a bytestring of the same length. `vectorized` is True if the bulk
+    functions work on all blocks at once rather than in a loop.
+
+    """
+    def __init__(self, name, encrypt_block, decrypt_block,
+                 encrypt_blocks=None, decrypt_blocks=None, vectorized=False):
+        self.name = name
+        self.encrypt_block = encrypt_block
+        self.decrypt_block = decrypt_block
+        self.encrypt_blocks = encrypt_blocks or _looped(encrypt_block)
+        self.decrypt_blocks = decrypt_blocks or _looped(decrypt_block)
+        self.vectorized = vectorized
+
+    def __repr__(self):
+        return '<geesefly backend %r>' % self.name
+
+def _looped(block_function):
+    """Return a bulk function calling `block_function` for each block.
+
+    Primarily for internal use.
+
+    """
+    unpack_from = words_format[8].unpack_from
+    pack = words_format[8].pack
+    def blocks_function(subkeys, data):
+        return empty_bytes.join(
+            pack(*block_function(subkeys, unpack_from(data, i)))
+            for i in xrange(0, len(data), 64))
+    return blocks_function
+
+def _int_backend():
+    """Return a backend running the rounds in plain loops over tables.
+
+    Primarily for internal use.
+
+    """
+    from .threefish import PERM, ROT
+
+    def encrypt_block(ks, block):
+        x = [(y + k) & max64 for y, k in izip(block, ks[0:8])]
+        for r in xrange(1, 19):
+            rot = ROT[16 * ((r - 1) % 2):]
+            for i in xrange(16):
+                m, n = PERM[i]
+                x[m] = (x[m] + x[n]) & max64
+                x[n] = ((x[n] << rot[i]) & max64 | x[n] >> (64 - rot[i])) ^ x[m]
+            x = [(y + k) & max64 for y, k in izip(x, ks[r*8:r*8+8])]
+        return x
+
+    def decrypt_block(ks, block):
+        x = list(block)
+        for r in xrange(18, 0, -1):
+            rot = ROT[16 * ((r - 1) % 2):]
+            x = [(y - k) & max64 for y, k in izip(x, ks[r*8:r*8+8])]
+            for i in xrange(15, -1, -1):
+                m, n = PERM[i]
+                x[n] ^= x[m]
+                x[n] = (x[n] >> rot[i] | x[n] << (64 - rot[i])) & max64
+                x[m] = (x[m] - x[n]) & max64
+        return [(y - k) & max64 for y, k in izip(x, ks[0:8])]
+
+    return Backend('int', encrypt_block, decrypt_block)
+
+def _unrolled_backend():
+    """Return a backend using the generated straight line functions.
+
+    Primarily for internal use.
+
+    """
+    from .threefish import _block_functions
+    expand_key, encrypt_block, decrypt_block = _block_functions()
+    return Backend('unrolled', encrypt_block, decrypt_block)
+
+def _numpy_installed():
+    """Return True if NumPy can be found, without importing it.
+
+    Primarily for internal use.
+
+    """
+    try:
+        from importlib.util import find_spec
+    except ImportError: # Python 2
+        import imp
+        try:
+            imp.find_module('numpy')
+        except ImportError:
+            return False
+        return True
+    try:
+        return find_spec('numpy') is not None
+    except ValueError: # e.g. sys.modules['numpy'] is None
+        return False
+
+def _numpy_backend():
+    """Return a backend running all blocks side by side with NumPy.
+
+    Fewer than 16 blocks cost less to process one by one than to set up
+    as a batch, so those are handed to the unrolled functions, and NumPy
+    itself is not imported until the first real batch.
+
+    Primarily for internal use.
+
+    """
+    if not _numpy_installed():
+        raise ImportError("NumPy is not installed")
+    unrolled = load_backend('unrolled')
+
+    def batched(name, looped):
+        def blocks_function(subkeys, data):
+            count = len(data) // 64
+            if count < 16:
+                return looped(subkeys, data)
+            from . import util_numpy
+            np = util_numpy.np
+            blocks = np.frombuffer(data, dtype=util_numpy.block_dtype,
+                                   count=count * 8).reshape(count, 8)
+            subkeys = np.array(subkeys, dtype=np.uint64)
+            output = getattr(util_numpy, name)(blocks, subkeys)
+            return util_numpy.words2bytes(output)
+        return blocks_function
+
+    def single(name):
+        def block_function(subkeys, block):
+            from . import util_numpy
+            np = util_numpy.np
+            return [int(y) for y in getattr(util_numpy, name)(
+                np.array([block], dtype=np.uint64),
+                np.array(subkeys, dtype=np.uint64))[0]]
+        return block_function
+
+    return Backend('numpy', single('encrypt_blocks'),
+                   single('decrypt_blocks'),
+                   batched('encrypt_blocks', unrolled.encrypt_blocks),
+                   batched('decrypt_blocks', unrolled.decrypt_blocks),
+                   vectorized=True)
+
+def _swar_backend():
+    """Return a backend packing many blocks into each Python integer.
+
+    Single blocks, and runs of fewer than 3 blocks, are faster with the
+    unrolled functions, so those are handed over to them.
+
+    Primarily for internal use.
+
+    """
+    from . import swar
+    unrolled = load_backend('unrolled')
+
+    def batched(packed, looped):
+        def blocks_function(subkeys, data):
+            if len(data) < 3 * 64:
+                return looped(subkeys, data)
+            return packed(subkeys, data)
+        return blocks_function
+
+    return Backend('swar', unrolled.encrypt_block, unrolled.decrypt_block,
+                   batched(swar.encrypt_blocks, unrolled.encrypt_blocks),
+                   batched(swar.decrypt_blocks, unrolled.decrypt_blocks),
+                   vectorized=True)
+
+_factories = OrderedDict()
+_backends = {}
+_selected = {}
+_explicit = set() # operations given a backend by set_backend
+
+def register_backend(name, factory):
+    """Add a backend under `name`.
+
+    `factory` is called without arguments the first time the backend is
+    needed, and returns a ``Backend``. It may raise ``ImportError`` if
+    the backend cannot be used on this system.
+
+    """
+    _factories[name] = factory
+    _backends.pop(name, None)
+
+register_backend('int', _int_backend)
+register_backend('unrolled', _unrolled_backend)
+register_backend('numpy', _numpy_backend)
+register_backend('swar', _swar_backend)
+
+def load_backend(name):
+    """Return the ``Backend`` registered as `name`.
+
+    Raises ``KeyError`` for an unknown name, and ``ImportError`` if the
+    backend cannot be used on this system.
+
+    """
+    if name not in _backends:
+        try:
+            _backends[name] = _factories[name]()
+        except ImportError:
+            _backends[name] = None
+    if _backends[name] is None:
+        raise ImportError("backend %r is not available" % name)
+    return _backends[name]
+
+def available_backends():
+    """Return the names of the backends usable on this system."""
+    names = []
+    for name in _factories:
+        try:
+            load_backend(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+def set_backend(name, operation=None):
+    """Use backend `name` for `operation`, or for all operations.
+
+    `name` may also be ``None`` to return to the default choice.
+
+    """
+    for op in operation and (operation,) or OPERATIONS:
+        if op not in OPERATIONS:
+            raise ValueError("unknown operation %r" % op)
+        if name is None:
+            _selected.pop(op, None)
+            _explicit.discard(op)
+        else:
+            _selected[op] = load_backend(name)
+            _explicit.add(op)
+
+def get_backend(operation):
+    """Return the ``Backend`` in use for `operation`."""
+    try:
+        return _selected[operation]
+    except KeyError:
+        pass
+    if operation not in OPERATIONS:
+        raise ValueError("unknown operation %r" % operation)
+    _configure()
+    return _selected[operation]
+
+# backends to use when nothing else is chosen, and when the chosen one
+# is unknown or not available
+_default = {'single': 'unrolled', 'bulk': 'numpy'}
+_fallback = {'single': 'unrolled', 'bulk': 'swar'}
+
+def _parse_setting(setting):
+    """Return the backend choice given by a ``GEESEFLY_BACKEND`` value.
+
+    Operations the setting leaves out get the default backend.
+
+    Primarily for internal use.
+
+    """
+    choice = dict(_default)
+    if '=' not in setting:
+        if setting:
+            choice = dict.fromkeys(OPERATIONS, setting)
+        return choice
+    for item in setting.split(','):
+        op, sep, name = [part.strip() for part in item.partition('=')]
+        if not sep or op not in OPERATIONS or not name:
+            raise ValueError("invalid GEESEFLY_BACKEND setting %r: expected "
+                             "a backend name, 'auto', or a list like "
+                             "'single=unrolled,bulk=numpy'" % setting)
+        choice[op] = name
+    return choice
+
+def _configure():
+    """Make the initial choice of backends.
+
+    Primarily for internal use.
+
+    """
+    setting = os.environ.get('GEESEFLY_BACKEND', '').strip()
+    if setting == 'auto':
+        choice = calibrate()
+    else:
+        choice = _parse_setting(setting)
+    for op in OPERATIONS:
+        if op in _selected:
+            continue
+        try:
+            _selected[op] = load_backend(choice[op])
+        except (ImportError, KeyError):
+            _selected[op] = load_backend(_fallback[op])
+
+def _cache_file():
+    """Return the path of the calibration cache.
+
+    Primarily for internal use.
+
+    """
+    directory = os.environ.get('GEESEFLY_CACHE_DIR') or os.path.join(
+        os.path.expanduser('~'), '.cache', 'geesefly')
+    return os.path.join(directory, 'backends.json')
+
+def _time(function, *args):
+    """Return the best time of a few calls of `function`.
+
+    Primarily for internal use.
+
+    """
+    import timeit
+    return min(timeit.repeat(lambda: function(*args), number=3, repeat=3))
+
+def _apply(choice):
+    """Use the backends in `choice`, except where ``set_backend`` chose.
+
+    Primarily for internal use.
+
+    """
+    for op in OPERATIONS:
+        if op not in _explicit:
+            _selected[op] = load_backend(choice[op])
+
+def calibrate(cache=True):
+    """Time every available backend and use the fastest for each operation.
+
+    Returns a dictionary mapping each operation to the fastest backend
+    name, which is then used for every operation not given a backend
+    with ``set_backend``. With `cache` True, the result is saved to a file under
+    ``~/.cache/geesefly`` (or the ``GEESEFLY_CACHE_DIR`` directory) and
+    reused by later calibrations on the same interpreter and machine.
+
+    """
+    import json
+    import platform
+    system = '%s %s %s' % (platform.python_implementation(),
+                           platform.python_version(), platform.machine())
+    names = available_backends()
+    path = _cache_file()
+    cached = {}
+    if cache:
+        try:
+            f = open(path)
+            try:
+                cached = json.load(f)
+            finally:
+                f.close()
+        except (IOError, OSError, ValueError):
+            cached = {}
+        if not isinstance(cached, dict): # not written by this function
+            cached = {}
+        choice = cached.get(system)
+        if (isinstance(choice, dict) and
+                all(choice.get(op) in names for op in OPERATIONS)):
+            _apply(choice)
+            return choice
+
+    subkeys = tuple(xrange(152))
+    block = list(xrange(8))
+    data = zero_bytes * 64
+    single = dict((name, _time(load_backend(name).encrypt_block,
+                               subkeys, block)) for name in names)
+    bulk = dict((name, _time(load_backend(name).encrypt_blocks,
+                             subkeys, data)) for name in names)
+    choice = {'single': min(single, key=single.get),
+              'bulk': min(bulk, key=bulk.get)}
+    _apply(choice)
+
+    if cache:
+        cached[system] = choice
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            f = open(path, 'w')
+            try:
+                json.dump(cached, f, indent=1, sort_keys=True)
+            finally:
+                f.close()
+        except (IOError, OSError):
+            pass
+    return choice
@@ -20,10 +20,13 @@
 import operator
 import struct
 import zlib
+from collections import OrderedDict
 
-from .threefish import (bytes2words, imap, Threefish512, words2bytes,
-                        xrange)
-from .skein import (empty_bytes, Skein512, Skein512Random)
+from .backends import get_backend
+from .threefish import (add64, bytes2words, imap, Threefish512, words2bytes,
+                        words_format, xrange)
+from .skein import (empty_bytes, Skein512, Skein512SharedRandom)
+from .util import xor_bytes
 
 class AuthenticationError(Exception):
     pass
@@ -33,14 +36,301 @@ class AuthenticationError(Exception):
 # bytestring whether we are using Python 2 or 3
 ciphertext_prefix = '___ciphertext___'.encode()
 
+# Prefix for ciphertext encoded with the encrypt_ctr function
+ctr_prefix = '___ctr_cipher___'.encode()
+
+def _derive_key(key, salt, digest_bits):
+    """Return `digest_bits` of key material derived from `key` and `salt`.
+
+    Primarily for internal use.
+
+    """
+    return Skein512(msg=key, digest_bits=digest_bits, key=salt,
+                    block_type='nonce').final()
+
+# The generator for all salts, created when first needed
+_salt_random = []
+
+class Cipher(object):
+    """Encryption context for many messages under one `key`.
+
+    The module level functions and classes derive a Threefish key, IV
+    and (where needed) MAC key from `key` and a random salt for every
+    message. A ``Cipher`` keeps a cache of the last `cache_size`
+    derived keys with their Threefish key schedules, so that repeated
+    setup work is shared. The output is exactly the same as that of the
+    module level functions.
+
+    All salts come from one ``Skein512SharedRandom``, so a ``Cipher``
+    may be used from several threads, and from processes forked after
+    it was created, without ever repeating a salt.
+
+    A ``Cipher`` may be passed in place of `key` to any of the
+    functions and classes in this module.
+
+    """
+    def __init__(self, key, cache_size=64):
+        self.key = key
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+
+    def new_salt(self):
+        """Return a new random 16-byte salt."""
+        if not _salt_random:
+            _salt_random.append(Skein512SharedRandom())
+        return _salt_random[0].getbytes(16)
+
+    def derive(self, salt, digest_bits):
+        """Return a ``Threefish512``, IV and MAC derived using `salt`.
+
+        `digest_bits` is the amount of key material to derive: 1024
+        for a key and IV, or 1280 to include a MAC key, in which case
+        the MAC is returned as a keyed ``Skein512`` to be copied for
+        each use; otherwise it is None.
+
+        """
+        cache_key = (salt, digest_bits)
+        try:
+            derived = self.cache.pop(cache_key)
+        except KeyError:
+            hashed = _derive_key(self.key, salt, digest_bits)
+            tf = Threefish512(hashed[:64])
+            tf.schedule # computed now, so cached along with the cipher
+            mac = None
+            if digest_bits > 1024:
+                mac = Skein512(key=hashed[128:])
+            derived = (tf, hashed[64:128], mac)
+        if self.cache_size:
+            self.cache[cache_key] = derived
+            while len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return derived
+
+    def encrypt(self, data):
+        """Same as the ``encrypt`` function, using this context."""
+        return encrypt(data, self)
+
+    def compress_encrypt_auth(self, data):
+        """Same as the ``compress_encrypt_auth`` function, using this
+        context."""
+        return compress_encrypt_auth(data, self)
+
+    def encrypt_ctr(self, data):
+        """Same as the ``encrypt_ctr`` function, using this context."""
+        return encrypt_ctr(data, self)
+
+    def decrypt_ctr_range(self, data, start, stop):
+        """Same as the ``decrypt_ctr_range`` function, using this
+        context."""
+        return decrypt_ctr_range(data, self, start, stop)
+
+def _as_cipher(key):
+    """Return `key` if it is a ``Cipher``, or a new uncached one for it.
+
+    Primarily for internal use.
+
+    """
+    if isinstance(key, Cipher):
+        return key
+    return Cipher(key, 0)
+
+def _cbc_decrypt(tf, iv, data):
+    """Return CBC-decrypted `data`, with padding still attached.
+
+    Each plaintext block depends only on its own ciphertext block and
+    the one before it, so the whole ciphertext is decrypted with the
+    "bulk" backend and XORed with the shifted ciphertext in one pass.
+
+    Primarily for internal use.
+
+    """
+    end = len(data) - len(data) % 64
+    decrypted = get_backend('bulk').decrypt_blocks(tf.schedule.subkeys,
+                                                   data[:end])
+    return xor_bytes(decrypted, (iv + data[:end])[:end])
+
+def _unpad(data):
+    """Return `data` with the padding added before encryption removed.
+
+    Primarily for internal use.
+
+    """
+    if not data:
+        return data
+    return data[:-struct.unpack("B", data[-1:])[0]]
+
+class _CBCEncrypt(object):
+    """Incremental CBC encryption of whole blocks, padding the last.
+
+    Primarily for internal use.
+
+    """
+    def __init__(self, tf, iv):
+        self.tf = tf
+        self.previous_block = bytes2words(iv)
+        self.buf = bytearray()
+
+    def update(self, data):
+        """Return ciphertext for the complete blocks received so far."""
+        buf = self.buf
+        buf.extend(data)
+        end = len(buf) - len(buf) % 64
+        unpack_from = words_format[8].unpack_from
+        encrypt_block = self.tf.encrypt_block
+        previous_block = self.previous_block
+        output = []
+        for i in xrange(0, end, 64):
+            previous_block = encrypt_block(list(imap(operator.xor,
+                                                     previous_block,
+                                                     unpack_from(buf, i))))
+            output.append(words2bytes(previous_block))
+        self.previous_block = previous_block
+        del buf[:end]
+        return empty_bytes.join(output)
+
+    def finalize(self):
+        """Return the padded, encrypted last block."""
+        pad_val = 64 - len(self.buf)
+        self.buf.extend(struct.pack("B", pad_val) * pad_val)
+        return self.update(empty_bytes)
+
+class _CBCDecrypt(object):
+    """Incremental CBC decryption, removing padding from the last block.
+
+    Primarily for internal use.
+
+    """
+    def __init__(self, tf, iv):
+        self.tf = tf
+        self.previous_block = iv
+        self.buf = bytearray()
+
+    def update(self, data):
+        """Return plaintext for the blocks received so far.
+
+        The last complete block is held back, as it may hold padding.
+
+        """
+        buf = self.buf
+        buf.extend(data)
+        end = max(len(buf) - 1, 0) // 64 * 64
+        if not end:
+            return empty_bytes
+        data = bytes(buf[:end])
+        del buf[:end]
+        output = _cbc_decrypt(self.tf, self.previous_block, data)
+        self.previous_block = data[-64:]
+        return output
+
+    def finalize(self):
+        """Return the last block of plaintext, without padding."""
+        end = len(self.buf) // 64 * 64
+        data = bytes(self.buf[:end])
+        del self.buf[:]
+        return _unpad(_cbc_decrypt(self.tf, self.previous_block, data))
+
+class Encryptor(object):
+    """Incremental version of ``encrypt`` for encrypting data.
+
+    Pass plaintext to ``update`` in as many pieces as needed; each
+    call returns the ciphertext that can be produced so far, and
+    ``finalize`` returns the rest. Joined together, the pieces are
+    the same as the output of ``encrypt``, so data of any size can be
+    encrypted in constant memory.
+
+    `salt` is for internal use and testing; by default a random one
+    is generated.
+
+    """
+    def __init__(self, key, salt=None):
+        cipher = _as_cipher(key)
+        if salt is None:
+            salt = cipher.new_salt()
+        tf, iv, mac = cipher.derive(salt, 1024)
+        self.header = ciphertext_prefix + salt
+        self.cbc = _CBCEncrypt(tf, iv)
+
+    def update(self, data):
+        """Return ciphertext for `data` and any data buffered before."""
+        output = self.header + self.cbc.update(data)
+        self.header = empty_bytes
+        return output
+
+    def finalize(self):
+        """Return the last of the ciphertext."""
+        return self.update(empty_bytes) + self.cbc.finalize()
+
+class Decryptor(object):
+    """Incremental version of ``encrypt`` for decrypting data.
+
+    Pass ciphertext (as produced by ``encrypt`` or ``Encryptor``) to
+    ``update`` in as many pieces as needed; each call returns the
+    plaintext that can be produced so far, and ``finalize`` returns
+    the rest.
+
+    """
+    def __init__(self, key):
+        self.cipher = _as_cipher(key)
+        self.header = bytearray()
+        self.cbc = None
+
+    def update(self, data):
+        """Return plaintext for `data` and any data buffered before."""
+        if self.cbc is None:
+            self.header.extend(data)
+            if len(self.header) < 32:
+                return empty_bytes
+            header = bytes(self.header)
+            if not header.startswith(ciphertext_prefix):
+                raise ValueError("data is not ciphertext")
+            tf, iv, mac = self.cipher.derive(header[16:32], 1024)
+            self.cbc = _CBCDecrypt(tf, iv)
+            self.cipher = self.header = None
+            data = header[32:]
+        return self.cbc.update(data)
+
+    def finalize(self):
+        """Return the last of the plaintext."""
+        if self.cbc is None:
+            return empty_bytes
+        return self.cbc.finalize()
+
+def encrypt_file(infile, outfile, key, chunk_size=65536):
+    """Encrypt the contents of `infile`, writing it to `outfile`.
+
+    Both are file-like objects opened in binary mode. This works like
+    ``encrypt``, including decrypting if `infile` starts with
+    "___ciphertext___", but only `chunk_size` bytes are held in
+    memory at a time.
+
+    """
+    data = infile.read(chunk_size)
+    while len(data) < len(ciphertext_prefix):
+        more = infile.read(chunk_size)
+        if not more:
+            break
+        data += more
+    if data.startswith(ciphertext_prefix):
+        cipher = Decryptor(key)
+    else:
+        cipher = Encryptor(key)
+    while data:
+        outfile.write(cipher.update(data))
+        data = infile.read(chunk_size)
+    outfile.write(cipher.finalize())
+
 def encrypt(data, key):
     """Return ciphertext, encrypting `data` with `key`.
 
-    Both `data` and `key` may be of arbitrary length.
+    Both `data` and `key` may be of arbitrary length. `key` may also
+    be a ``Cipher``.
 
     If `data` begins with the string "___ciphertext___", a decryption
     process will occur instead of encryption.
 
+    For data that should not be held in memory all at once, see
+    ``Encryptor``, ``Decryptor`` and ``encrypt_file``.
+
     Example:
 
     >>> from binascii import b2a_hex
@@ -54,49 +344,10 @@ def encrypt(data, key):
 
     """
     if data.startswith(ciphertext_prefix):
-        encrypt = False
-        salt = data[16:32]
-        data = data[32:]
-    else:
-        encrypt = True
-        salt = Skein512Random().getbytes(16)
-
-    hashed = Skein512(msg=key, digest_bits=1024, key=salt,
-                      block_type='nonce').final()
-    key = hashed[:64]
-    iv = hashed[64:]
-    tf = Threefish512(key)
-    
-    previous_block = bytes2words(iv)
-    if encrypt:
-        output = ciphertext_prefix + salt
-        blocks, remainder = divmod(len(data), 64)
-        for block in (bytes2words(data[i*64:(i+1)*64])
-                      for i in xrange(blocks)):
-            previous_block = tf.encrypt_block(list(imap(operator.xor,
-                                                        previous_block,
-                                                        block)))
-            output += words2bytes(previous_block)
-
-        pad_val = 64 - remainder
-        pad = struct.pack("B", pad_val) * pad_val
-        if remainder:
-            pad = data[-remainder:] + pad
-        block = list(imap(operator.xor, previous_block,
-                          bytes2words(pad)))
-        output += words2bytes(tf.encrypt_block(block))
+        cipher = Decryptor(key)
     else:
-        output = empty_bytes
-        for block in (bytes2words(data[i*64:(i+1)*64])
-                      for i in xrange(len(data)//64)):
-            output += words2bytes(list(imap(operator.xor,
-                                            previous_block,
-                                            tf.decrypt_block(block))))
-            previous_block = block
-
-        output = output.rstrip(output[-1:])
-
-    return output
+        cipher = Encryptor(key)
+    return cipher.update(data) + cipher.finalize()
 
 def compress_encrypt_auth(data, key):
     """Return ciphertext, compressing then encrypting `data` with `key`.
@@ -105,7 +356,8 @@ def compress_encrypt_auth(data, key):
     MAC and a key derived from `key`, but not the same key as used to
     encrypt the data.
 
-    Both `data` and `key` may be of arbitrary length.
+    Both `data` and `key` may be of arbitrary length. `key` may also
+    be a ``Cipher``.
 
     If `data` begins with the string "___ciphertext___", a decryption
     process will occur instead of encryption.
@@ -126,54 +378,281 @@ def compress_encrypt_auth(data, key):
     the performance problems of geesefly.py.
 
     """
+    cipher = _as_cipher(key)
     if data.startswith(ciphertext_prefix):
-        encrypt = False
         received_mac = data[16:80]
         salt = data[80:96]
         data = data[96:]
     else:
-        encrypt = True
-        salt = Skein512Random().getbytes(16)
-        data = zlib.compress(data)
-
-    hashed = Skein512(msg=key, digest_bits=1280, key=salt,
-                      block_type='nonce').final()
-    key = hashed[:64]
-    iv = hashed[64:128]
-    mac_key = hashed[128:]
-    tf = Threefish512(key)
-
-    previous_block = bytes2words(iv)
-    if encrypt:
-        output = empty_bytes
-        blocks, remainder = divmod(len(data), 64)
-        for block in (bytes2words(data[i*64:(i+1)*64])
-                      for i in xrange(blocks)):
-            previous_block = tf.encrypt_block(list(imap(operator.xor,
-                                                        previous_block,
-                                                        block)))
-            output += words2bytes(previous_block)
-
-        pad_val = 64 - remainder
-        pad = struct.pack("B", pad_val) * pad_val
-        if remainder:
-            pad = data[-remainder:] + pad
-        block = list(imap(operator.xor, previous_block,
-                          bytes2words(pad)))
-        output += words2bytes(tf.encrypt_block(block))
-        output = ciphertext_prefix +  Skein512(msg=output, key=mac_key).final() + salt + output
+        received_mac = None
+        salt = cipher.new_salt()
 
-    else:
-        if received_mac != Skein512(msg=data, key=mac_key).final():
+    tf, iv, mac = cipher.derive(salt, 1280)
+    mac = mac.copy()
+
+    if received_mac is None:
+        cbc = _CBCEncrypt(tf, iv)
+        compressor = zlib.compressobj()
+        output = (cbc.update(compressor.compress(data)) +
+                  cbc.update(compressor.flush()) + cbc.finalize())
+        mac.update(output)
+        return ciphertext_prefix + mac.final() + salt + output
+
+    mac.update(data)
+    if received_mac != mac.final():
+        raise AuthenticationError
+    return zlib.decompress(_unpad(_cbc_decrypt(tf, iv, data)))
+
+# Prefix for the chunked format written by AuthEncryptor
+auth_stream_prefix = '___authstream___'.encode()
+
+# Each chunk of an AuthEncryptor stream starts with the length of its
+# ciphertext, with the high bit set for the final chunk
+chunk_header = struct.Struct('>I')
+final_chunk = 0x80000000
+
+# Largest chunk of ciphertext AuthEncryptor writes, and AuthDecryptor
+# accepts (it must buffer a whole chunk before authenticating it)
+max_chunk_size = 1 << 24
+
+def _chunk_mac(mac, number, header, ciphertext):
+    """Return the MAC of a chunk, using a copy of keyed Skein512 `mac`.
+
+    Primarily for internal use.
+
+    """
+    mac = mac.copy()
+    mac.update(struct.pack('>Q', number) + header)
+    mac.update(ciphertext)
+    return mac.final()
+
+class AuthEncryptor(object):
+    """Streaming counterpart of ``compress_encrypt_auth`` for encrypting.
+
+    Data passed to ``update`` is compressed with zlib, encrypted and
+    authenticated as it arrives, and each call returns the output
+    that is ready so far; ``finalize`` returns the rest. Keys are
+    derived from `key` just as in ``compress_encrypt_auth``.
+
+    As the MAC of a single message cannot be known before all of it
+    has been encrypted, the output uses a chunked format of its own:
+    the string "___authstream___" and the salt, followed by chunks of
+    at most `chunk_size` (and no more than 16 MiB) bytes of
+    ciphertext. Each chunk holds a
+    4-byte length (its high bit marking the final chunk), the
+    ciphertext, and a Skein MAC over the chunk number, length and
+    ciphertext, so ``AuthDecryptor`` can authenticate and release
+    each chunk's plaintext as soon as it arrives.
+
+    `salt` is for internal use and testing; by default a random one
+    is generated.
+
+    """
+    def __init__(self, key, chunk_size=65536, salt=None):
+        cipher = _as_cipher(key)
+        if salt is None:
+            salt = cipher.new_salt()
+        tf, iv, self.mac = cipher.derive(salt, 1280)
+        self.cbc = _CBCEncrypt(tf, iv)
+        self.compressor = zlib.compressobj()
+        chunk_size = min(chunk_size, max_chunk_size)
+        self.chunk_size = max(chunk_size - chunk_size % 64, 64)
+        self.chunks = 0
+        self.buf = bytearray()
+        self.header = auth_stream_prefix + salt
+
+    def _chunks(self, final):
+        """Return complete chunks from the buffered ciphertext.
+
+        Primarily for internal use.
+
+        """
+        output = [self.header]
+        self.header = empty_bytes
+        buf = self.buf
+        size = self.chunk_size
+        while len(buf) > size or (len(buf) == size and not final):
+            output.append(self._chunk(bytes(buf[:size]), 0))
+            del buf[:size]
+        if final:
+            output.append(self._chunk(bytes(buf), final_chunk))
+            del buf[:]
+        return empty_bytes.join(output)
+
+    def _chunk(self, ciphertext, flags):
+        """Return one chunk holding `ciphertext`.
+
+        Primarily for internal use.
+
+        """
+        header = chunk_header.pack(len(ciphertext) | flags)
+        mac = _chunk_mac(self.mac, self.chunks, header, ciphertext)
+        self.chunks += 1
+        return header + ciphertext + mac
+
+    def update(self, data):
+        """Return output for `data` and any data buffered before."""
+        self.buf.extend(self.cbc.update(self.compressor.compress(data)))
+        return self._chunks(False)
+
+    def finalize(self):
+        """Return the last of the output, ending with the final chunk."""
+        self.buf.extend(self.cbc.update(self.compressor.flush()))
+        self.buf.extend(self.cbc.finalize())
+        return self._chunks(True)
+
+class AuthDecryptor(object):
+    """Streaming counterpart of ``compress_encrypt_auth`` for decrypting.
+
+    Pass output from ``AuthEncryptor`` to ``update`` in as many pieces
+    as needed. Each chunk is authenticated as soon as it is complete,
+    and only then decrypted and decompressed, so the plaintext that is
+    returned has always been authenticated. ``AuthenticationError`` is
+    raised for a chunk that fails authentication, and by ``finalize``
+    if the final chunk never arrived.
+
+    """
+    def __init__(self, key):
+        self.cipher = _as_cipher(key)
+        self.buf = bytearray()
+        self.cbc = None
+        self.chunks = 0
+        self.done = False
+
+    def update(self, data):
+        """Return authenticated plaintext for the chunks completed so far."""
+        buf = self.buf
+        buf.extend(data)
+        if self.cbc is None:
+            if len(buf) < 32:
+                return empty_bytes
+            if bytes(buf[:16]) != auth_stream_prefix:
+                raise ValueError("data is not an authenticated stream")
+            tf, iv, self.mac = self.cipher.derive(bytes(buf[16:32]), 1280)
+            self.cbc = _CBCDecrypt(tf, iv)
+            self.decompressor = zlib.decompressobj()
+            self.cipher = None
+            del buf[:32]
+
+        output = []
+        while not self.done and len(buf) >= chunk_header.size:
+            header = bytes(buf[:chunk_header.size])
+            length = chunk_header.unpack(header)[0]
+            flags = length & final_chunk
+            length ^= flags
+            end = chunk_header.size + length
+            if not length or length % 64 or length > max_chunk_size:
+                raise AuthenticationError
+            if len(buf) < end + 64:
+                break
+            ciphertext = bytes(buf[chunk_header.size:end])
+            if (bytes(buf[end:end+64]) !=
+                _chunk_mac(self.mac, self.chunks, header, ciphertext)):
+                raise AuthenticationError
+            del buf[:end+64]
+            self.chunks += 1
+            plaintext = self.cbc.update(ciphertext)
+            if flags:
+                plaintext += self.cbc.finalize()
+                self.done = True
+            output.append(self.decompressor.decompress(plaintext))
+        if self.done:
+            output.append(self.decompressor.flush())
+        return empty_bytes.join(output)
+
+    def finalize(self):
+        """Check that the stream was complete."""
+        if not self.done or self.buf:
             raise AuthenticationError
+        return empty_bytes
+
+def compress_encrypt_auth_file(infile, outfile, key, chunk_size=65536):
+    """Compress, encrypt and authenticate `infile` into `outfile`.
+
+    Both are file-like objects opened in binary mode. Uses
+    ``AuthEncryptor``, or ``AuthDecryptor`` if `infile` starts with
+    "___authstream___", reading `chunk_size` bytes at a time.
+
+    """
+    data = infile.read(chunk_size)
+    while len(data) < len(auth_stream_prefix):
+        more = infile.read(chunk_size)
+        if not more:
+            break
+        data += more
+    if data.startswith(auth_stream_prefix):
+        cipher = AuthDecryptor(key)
+    else:
+        cipher = AuthEncryptor(key, chunk_size)
+    while data:
+        outfile.write(cipher.update(data))
+        data = infile.read(chunk_size)
+    outfile.write(cipher.finalize())
+
+def _ctr_crypt(tf, iv, data, first_block=0):
+    """Return `data` XORed with the counter mode keystream.
+
+    Keystream block i is the encryption of `iv` (a list of 8 words)
+    with `first_block` + i added to its first word. The blocks do not
+    depend on each other, so they are all generated with the "bulk"
+    backend.
+
+    Primarily for internal use.
+
+    """
+    length = len(data)
+    pack = words_format[8].pack
+    counter = list(iv)
+    counters = []
+    for i in xrange(first_block, first_block + (length + 63) // 64):
+        counter[0] = add64(iv[0], i)
+        counters.append(pack(*counter))
+    keystream = get_backend('bulk').encrypt_blocks(tf.schedule.subkeys,
+                                                   empty_bytes.join(counters))
+    return xor_bytes(data, keystream[:length])
+
+def encrypt_ctr(data, key):
+    """Return ciphertext, encrypting `data` with `key` in counter mode.
+
+    Works like ``encrypt``, deriving the Threefish key and initial
+    counter block from `key` and a random salt in the same way, but
+    the ciphertext is the same length as `data` (plus a 32 byte
+    header) and every block can be en/decrypted independently. See
+    ``decrypt_ctr_range`` for decrypting part of a message.
+
+    If `data` begins with the string "___ctr_cipher___", a decryption
+    process will occur instead of encryption.
+
+    """
+    cipher = _as_cipher(key)
+    if data.startswith(ctr_prefix):
+        salt = data[16:32]
+        data = data[32:]
         output = empty_bytes
-        for block in (bytes2words(data[i*64:(i+1)*64])
-                      for i in xrange(len(data)//64)):
-            output += words2bytes(list(imap(operator.xor,
-                                            previous_block,
-                                            tf.decrypt_block(block))))
-            previous_block = block
+    else:
+        salt = cipher.new_salt()
+        output = ctr_prefix + salt
 
-        output = zlib.decompress(output.rstrip(output[-1:]))
+    tf, iv, mac = cipher.derive(salt, 1024)
+    return output + _ctr_crypt(tf, bytes2words(iv), data)
+
+def decrypt_ctr_range(data, key, start, stop):
+    """Return bytes `start` to `stop` of the plaintext encrypted in `data`.
+
+    `data` is ciphertext produced by ``encrypt_ctr``, and only the
+    blocks covering the requested range are decrypted. ``ValueError``
+    is raised if `data` is not in that format.
+
+    """
+    if bytes(data[:16]) != ctr_prefix:
+        raise ValueError("data is not counter mode ciphertext")
+    salt = data[16:32]
+    data = data[32:]
+    stop = min(stop, len(data))
+    if start >= stop:
+        return empty_bytes
+    first_block, offset = divmod(start, 64)
 
-    return output
+    tf, iv, mac = _as_cipher(key).derive(salt, 1024)
+    return _ctr_crypt(tf, bytes2words(iv),
+                      data[first_block * 64:stop], first_block)[offset:]
@@ -0,0 +1,385 @@
+# /usr/bin/env python
+# coding=utf-8
+
+#  Copyright 2010 Jonathan Bowman
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+#  implied. See the License for the specific language governing
+#  permissions and limitations under the License.
+
+"""hashlib-style Skein-256, Skein-512 and Skein-1024 hash objects
+
+``new`` returns a hash object for any of the three Skein state sizes
+and any output size, with the ``name``, ``digest_size``,
+``block_size``, ``update``, ``copy``, ``digest`` and ``hexdigest`` that
+``hashlib`` objects have, so that it can be used wherever they can (for
+example with ``hmac``). The object comes from the first registered
+implementation able to handle the request: the compiled ``pyskein``
+module if it is installed, and the pure Python classes here otherwise.
+
+"""
+
+from __future__ import absolute_import
+
+import binascii
+import re
+import struct
+
+from .threefish import _compile, ubi as _ubi512
+from .util import (max64, SKEIN_KS_PARITY, words_format, words_format_tpl,
+                   xrange, zero_bytes)
+
+empty_bytes = zero_bytes[:0]
+
+# Rotation constants for each round modulo 8, the word permutation
+# applied after each round, and the number of rounds, as given in the
+# Skein specification for each number of state words.
+_tables = {
+    4: (((14, 16), (52, 57), (23, 40), (5, 37),
+         (25, 33), (46, 12), (58, 22), (32, 32)),
+        (0, 3, 2, 1), 72),
+    8: (((46, 36, 19, 37), (33, 27, 14, 42), (17, 49, 36, 39),
+         (44, 9, 54, 56), (39, 30, 34, 24), (13, 50, 10, 17),
+         (25, 29, 39, 43), (8, 35, 56, 22)),
+        (2, 1, 4, 7, 6, 5, 0, 3), 72),
+    16: (((24, 13, 8, 47, 8, 17, 22, 37), (38, 19, 10, 55, 49, 18, 23, 52),
+          (33, 4, 51, 13, 34, 41, 59, 17), (5, 20, 48, 41, 47, 28, 16, 25),
+          (41, 9, 37, 31, 12, 47, 44, 30), (16, 34, 56, 51, 4, 53, 42, 41),
+          (31, 44, 47, 46, 19, 42, 44, 25), (9, 48, 35, 52, 23, 31, 37, 20)),
+         (0, 9, 2, 13, 6, 11, 4, 15, 10, 7, 12, 3, 14, 5, 8, 1), 80),
+}
+
+def _build_ubi(count):
+    """Return a generated UBI function for a state of `count` words.
+
+    Like ``threefish.ubi``, but following the tables of the Skein
+    specification directly: the permutation is applied to the variable
+    names while generating the code, so it costs nothing at run time.
+
+    Primarily for internal use.
+
+    """
+    rotations, permutation, rounds = _tables[count]
+
+    def subkey(s, y):
+        terms = ['k%d' % ((s + y) % (count + 1))]
+        if y == count - 3:
+            terms.append('t%d' % (s % 3))
+        elif y == count - 2:
+            terms.append('t%d' % ((s + 1) % 3))
+        elif y == count - 1 and s:
+            terms.append('%d' % s)
+        return ' + '.join(terms)
+
+    x = ['x%d' % y for y in xrange(count)]
+    enc = []
+    def inject(s):
+        enc.extend('%s = (%s + %s) & 0x%x' % (x[y], x[y], subkey(s, y), max64)
+                   for y in xrange(count))
+    inject(0)
+    for d in xrange(rounds):
+        for j, r in enumerate(rotations[d % 8]):
+            m, n = x[2 * j], x[2 * j + 1]
+            enc.append('%s = (%s + %s) & 0x%x' % (m, m, n, max64))
+            enc.append('%s = ((%s << %d) & 0x%x | %s >> %d) ^ %s' %
+                       (n, n, r, max64, n, 64 - r, m))
+        x = [x[p] for p in permutation]
+        if d % 4 == 3:
+            inject(d // 4 + 1)
+
+    state = ', '.join('x%d' % y for y in xrange(count))
+    msg = ', '.join('m%d' % y for y in xrange(count))
+    chain = ', '.join('k%d' % y for y in xrange(count))
+    body = (['%s = key[:%d]' % (chain, count),
+             't0, t1 = tweak[:2]',
+             'for i in xrange(0, len(data), %d):' % (count * 8),
+             '    %s = unpack_from(data, i)' % msg,
+             '    t0 = (t0 + byte_count_add) & 0x%x' % max64,
+             '    t2 = t0 ^ t1',
+             '    k%d = %s ^ 0x%x' % (count,
+                                      ' ^ '.join('k%d' % y
+                                                 for y in xrange(count)),
+                                      SKEIN_KS_PARITY),
+             '    %s = %s' % (state, msg)] +
+            ['    ' + line for line in enc] +
+            ['    k%d = %s ^ m%d' % (y, x[y], y) for y in xrange(count)] +
+            ['    t1 &= 0xbfffffffffffffff',
+             'return [%s], [t0, t1]' % chain])
+    unpack_from = struct.Struct(words_format_tpl % count).unpack_from
+    return _compile('ubi', 'key, tweak, data, byte_count_add', body,
+                    {'unpack_from': unpack_from, 'xrange': xrange})
+
+_ubi_functions = {8: _ubi512}
+
+def _ubi(count):
+    """Return the UBI function for `count` state words, building it once.
+
+    Primarily for internal use.
+
+    """
+    if count not in _ubi_functions:
+        _ubi_functions[count] = _build_ubi(count)
+    return _ubi_functions[count]
+
+_iv_cache = {}
+
+class SkeinHash(object):
+    """Base class of the pure Python hashlib-style Skein objects.
+
+    `data` is hashed right away, as if passed to ``update``.
+    `digest_bits` is the output size in bits, and defaults to the state
+    size. Use `key` (a bytestring with arbitrary length) for MAC
+    functionality. `legacy_key` is only accepted by ``Skein512Hash``.
+
+    Unlike ``Skein512``, ``digest`` leaves the object unchanged, so
+    more data can still be added afterwards, and ``hexdigest`` returns
+    a string, just as with ``hashlib``. When `digest_bits` is not a
+    multiple of 8, the unused low bits of the last byte are cleared, as
+    in the Skein specification.
+
+    """
+    __slots__ = ('chain', 'tweak', 'buf', 'digest_bits', 'digest_size')
+
+    name = None
+    block_bits = None
+    block_size = None
+    key_type = 0x4000000000000000
+    legacy_key_type = None
+    msg_type = 0x7000000000000000
+    cfg_type = 0xc400000000000000
+    out_type = 0xff00000000000000
+
+    def __init__(self, data=empty_bytes, digest_bits=None, key=None,
+                 legacy_key=False):
+        key_type = self.key_type
+        if legacy_key:
+            if self.legacy_key_type is None:
+                raise ValueError("legacy_key is only supported by Skein-512")
+            key_type = self.legacy_key_type
+        if digest_bits is None:
+            digest_bits = self.block_bits
+        if digest_bits <= 0:
+            raise ValueError("digest_bits must be positive")
+        self.digest_bits = digest_bits
+        self.digest_size = (digest_bits + 7) >> 3
+        if key:
+            chain = self._absorb([0] * (self.block_size // 8),
+                                 [0, key_type], key)
+            self.chain = self._absorb(chain, [0, self.cfg_type],
+                                      self._config())
+        else:
+            self.chain = self._config_iv(digest_bits)
+        self.tweak = [0, self.msg_type]
+        self.buf = bytearray()
+        if data is not None and len(data):
+            self.update(data)
+
+    def _config(self):
+        """Return the 32-byte configuration string.
+
+        Primarily for internal use.
+
+        """
+        return struct.pack('<4Q', 0x133414853, self.digest_bits, 0, 0)
+
+    def _config_iv(self, digest_bits):
+        """Return the unkeyed chaining value for a `digest_bits` output.
+
+        Primarily for internal use.
+
+        """
+        try:
+            return _iv_cache[self.block_bits, digest_bits]
+        except KeyError:
+            iv = _iv_cache[self.block_bits, digest_bits] = self._absorb(
+                [0] * (self.block_size // 8), [0, self.cfg_type],
+                self._config())
+            return iv
+
+    def _absorb(self, chain, tweak, data):
+        """Return the chaining value after hashing all of `data`.
+
+        The last block of `data` is processed with the final flag set.
+
+        Primarily for internal use.
+
+        """
+        size = self.block_size
+        ubi = _ubi(size // 8)
+        end = len(data) and (len(data) - 1) // size * size
+        if end:
+            chain, tweak = ubi(chain, tweak, data[:end], size)
+        block = bytearray(size)
+        block[:len(data) - end] = data[end:]
+        tweak = [tweak[0], tweak[1] | 0x8000000000000000] # final
+        return ubi(chain, tweak, block, len(data) - end)[0]
+
+    def update(self, data):
+        """Update the hash object with the bytes-like object `data`."""
+        buf = self.buf
+        buf += data
+        size = self.block_size
+        if len(buf) > size:
+            end = (len(buf) - 1) // size * size
+            self.chain, self.tweak = _ubi(size // 8)(self.chain, self.tweak,
+                                                     buf[:end], size)
+            del buf[:end]
+
+    def copy(self):
+        """Return a copy of the hash object."""
+        other = self.__class__.__new__(self.__class__)
+        other.chain = list(self.chain)
+        other.tweak = list(self.tweak)
+        other.buf = bytearray(self.buf)
+        other.digest_bits = self.digest_bits
+        other.digest_size = self.digest_size
+        return other
+
+    def digest(self):
+        """Return the digest of the data passed to ``update`` so far."""
+        chain = self._absorb(self.chain, self.tweak, self.buf)
+        pack = words_format[1].pack
+        output = [self._absorb(chain, [0, self.out_type], pack(i))
+                  for i in xrange((self.digest_size + self.block_size - 1)
+                                  // self.block_size)]
+        output = bytearray(struct.pack(
+            '<%dQ' % (len(output) * len(chain)),
+            *[word for block in output for word in block])[:self.digest_size])
+        if self.digest_bits & 7: # clear the bits past digest_bits
+            output[-1] &= (0xff00 >> (self.digest_bits & 7)) & 0xff
+        return bytes(output)
+
+    def hexdigest(self):
+        """Return the digest as a string of hexadecimal digits."""
+        return binascii.b2a_hex(self.digest()).decode('ascii')
+
+class Skein256Hash(SkeinHash):
+    """Skein-256, in pure Python."""
+    __slots__ = ()
+    name = 'Skein-256'
+    block_bits = 256
+    block_size = 32
+
+class Skein512Hash(SkeinHash):
+    """Skein-512, in pure Python.
+
+    ``Skein512`` hashes a key without the flag marking its first block,
+    so its keyed hashes differ from the Skein specification (and from
+    ``pyskein``); unkeyed hashes are not affected. Keyed hashes from
+    this class follow the specification, unless `legacy_key` is True,
+    in which case they match ``Skein512`` with the same key.
+
+    """
+    __slots__ = ()
+    name = 'Skein-512'
+    block_bits = 512
+    block_size = 64
+    legacy_key_type = 0 # as in Skein512.block_type
+
+class Skein1024Hash(SkeinHash):
+    """Skein-1024, in pure Python."""
+    __slots__ = ()
+    name = 'Skein-1024'
+    block_bits = 1024
+    block_size = 128
+
+_pure = {256: Skein256Hash, 512: Skein512Hash, 1024: Skein1024Hash}
+
+algorithms = ('skein256', 'skein512', 'skein1024')
+
+_name_pattern = re.compile(r'skein[-_]?(256|512|1024)(?:[-_/](\d+))?$', re.I)
+
+def _pyskein():
+    """Return the ``pyskein`` module, or None if it is not installed.
+
+    Primarily for internal use.
+
+    """
+    if not _pyskein_module:
+        try:
+            import skein
+        except ImportError:
+            skein = None
+        if not hasattr(skein, 'skein1024'):
+            skein = None
+        _pyskein_module.append(skein)
+    return _pyskein_module[0]
+
+_pyskein_module = []
+
+def _pyskein_factory(bits, data, digest_bits, key):
+    """Return a ``pyskein`` hash object, if it can give the same result.
+
+    Primarily for internal use.
+
+    """
+    module = _pyskein()
+    if module is None:
+        return None
+    return getattr(module, 'skein%d' % bits)(data, digest_bits=digest_bits,
+                                             key=key or empty_bytes)
+
+_factories = []
+
+def register_implementation(factory):
+    """Add `factory` as the preferred source of hash objects.
+
+    `factory` is called as ``factory(bits, data, digest_bits, key)``,
+    where `bits` is the state size (256, 512 or 1024), and returns a
+    hashlib-style object, or None if it cannot provide that hash.
+    Implementations registered later are tried first, and the pure
+    Python classes are used if none of them can help. The objects must
+    give the same digests as the pure Python classes.
+
+    """
+    _factories.insert(0, factory)
+
+register_implementation(_pyskein_factory)
+
+def new(name, data=empty_bytes, **params):
+    """Return a new hash object for the Skein hash called `name`.
+
+    `name` is ``skein256``, ``skein512`` or ``skein1024`` (any case,
+    and also spelled like ``Skein-512``), optionally followed by the
+    output size in bits, as in ``skein512-256``. `data` is hashed right
+    away. The parameters `digest_bits` (the output size, defaulting to
+    the state size) and `key` (for MAC functionality) may be given, and
+    ``pure=True`` skips the registered implementations.
+
+    Keyed hashes follow the Skein specification. For Skein-512,
+    ``legacy_key=True`` gives keyed hashes matching those of
+    ``Skein512`` instead (see ``Skein512Hash``); these always come from
+    the pure Python class.
+
+    """
+    match = _name_pattern.match(name)
+    if not match:
+        raise ValueError("unsupported hash type %s" % name)
+    bits = int(match.group(1))
+    digest_bits = params.pop('digest_bits', None)
+    if match.group(2):
+        if digest_bits not in (None, int(match.group(2))):
+            raise ValueError("conflicting output sizes for %s" % name)
+        digest_bits = int(match.group(2))
+    if digest_bits is None:
+        digest_bits = bits
+    key = params.pop('key', None)
+    legacy_key = params.pop('legacy_key', False)
+    pure = params.pop('pure', False) or legacy_key
+    if params:
+        raise TypeError("unexpected parameters: %s"
+                        % ', '.join(sorted(params)))
+    if not pure:
+        for factory in _factories:
+            hash_object = factory(bits, data, digest_bits, key)
+            if hash_object is not None:
+                return hash_object
+    return _pure[bits](data, digest_bits, key, legacy_key)
@@ -20,14 +20,107 @@
 import array
 import binascii
 import os
+import random
 import struct
+import threading
+import weakref
 
-from .threefish import (add64, bigint, bytes2words, Threefish512, words,
+try:
+    import mmap
+except ImportError: # e.g. on Google App Engine
+    mmap = None
+
+from .backends import get_backend
+from .threefish import (add64, bigint, bytes2words, Threefish512, ubi,
                         words2bytes, words_format, xrange,
                         zero_bytes, zero_words)
+from .util import izip, xor_bytes
 
 # An empty bytestring that behaves itself whether in Python 2 or 3
-empty_bytes = array.array('B').tostring()
+try:
+    empty_bytes = array.array('B').tobytes()
+except AttributeError: # Python 2
+    empty_bytes = array.array('B').tostring()
+
+# Chaining values after processing the configuration block, for the
+# output sizes listed in the Skein specification. Others are added the
+# first time they are needed by _config_iv.
+_iv_cache = {
+    128: (0xA8BC7BF36FBF9F52, 0x1E9872CEBD1AF0AA, 0x309B1790B32190D3,
+          0xBCFBB8543F94805C, 0x0DA61BCD6E31B11B, 0x1A18EBEAD46A32E3,
+          0xA2CC5B18CE84AA82, 0x6982AB289D46982D),
+    160: (0x28B81A2AE013BD91, 0xC2F11668B5BDF78F, 0x1760D8F3F6A56F12,
+          0x4FB747588239904F, 0x21EDE07F7EAF5056, 0xD908922E63ED70B8,
+          0xB8EC76FFECCB52FA, 0x01A47BB8A3F27A6E),
+    224: (0xCCD0616248677224, 0xCBA65CF3A92339EF, 0x8CCD69D652FF4B64,
+          0x398AED7B3AB890B4, 0x0F59D1B1457D2BD0, 0x6776FE6575D4EB3D,
+          0x99FBC70E997413E9, 0x9E2CFCCFE1C41EF7),
+    256: (0xCCD044A12FDB3E13, 0xE83590301A79A9EB, 0x55AEA0614F816E6F,
+          0x2A2767A4AE9B94DB, 0xEC06025E74DD7683, 0xE7A436CDC4746251,
+          0xC36FBAF9393AD185, 0x3EEDBA1833EDFC13),
+    384: (0xA3F6C6BF3A75EF5F, 0xB0FEF9CCFD84FAA4, 0x9D77DD663D770CFE,
+          0xD798CBF3B468FDDA, 0x1BC4A6668A0E4465, 0x7ED7D434E5807407,
+          0x548FC1ACD4EC44D6, 0x266E17546AA18FF8),
+    512: (0x4903ADFF749C51CE, 0x0D95DE399746DF03, 0x8FD1934127C79BCE,
+          0x9A255629FF352CB1, 0x5DB62599DF6CA7B0, 0xEABE394CA9D5C3F4,
+          0x991112C71A75B523, 0xAE18A40B660FCC33),
+}
+
+# Serialized hash state: chaining value, tweak, digest_bits,
+# digest_size and buffer length, followed by the buffered bytes
+_state_format = struct.Struct('<13Q')
+
+def _config_iv(digest_bits):
+    """Return the unkeyed chaining value for a `digest_bits` output.
+
+    Primarily for internal use.
+
+    """
+    try:
+        return _iv_cache[digest_bits]
+    except KeyError:
+        cfg = words2bytes((0x133414853,digest_bits,0,0,0,0,0,0))
+        iv = tuple(ubi(zero_words, [0, Skein512.block_type['cfg_final']],
+                       cfg, 32)[0])
+        _iv_cache[digest_bits] = iv
+        return iv
+
+# Serialized tree state: length of the Skein512 state, tree parameters
+# and number of hashed leaves, followed by the Skein512 state, the leaf
+# chaining values and the bytes not yet hashed
+_tree_state_format = struct.Struct('<3Q')
+
+# Serialized random generator state: length of the Skein512 state,
+# queue length, pool position, queue_size and pool_size, followed by the
+# Skein512 state, the queue and the pool
+_random_state_format = struct.Struct('<5Q')
+
+def _byte_view(data):
+    """Return a memoryview of `data` with one item per byte.
+
+    Primarily for internal use.
+
+    """
+    try:
+        return memoryview(data).cast('B')
+    except AttributeError: # no cast in Python 2
+        return memoryview(data)
+
+_unset = object()
+_slots = {}
+
+def _slot_names(cls):
+    """Return the names of the slots of `cls` and its base classes.
+
+    Primarily for internal use.
+
+    """
+    try:
+        return _slots[cls]
+    except KeyError:
+        names = _slots[cls] = [name for klass in cls.__mro__
+                               for name in getattr(klass, '__slots__', ())]
+        return names
 
 class Skein512(object):
     """Skein 512-bit hashing algorithm
@@ -36,7 +129,9 @@ class Skein512(object):
     passed in later using the ``update`` method.
 
     Use `key` (a bytestring with arbitrary length) for MAC
-    functionality.
+    functionality. When many messages are authenticated with the same
+    key, create the keyed object once and use ``copy`` to start each
+    message from its saved state, rather than hashing the key again.
 
     `block_type` will typically be "msg", but may also be one of:
     "key", "nonce", "cfg_final", or "out_final". These will affect the
@@ -50,8 +145,11 @@ class Skein512(object):
     '8449f597f1764274f8bf4a03ead22e0404ea2dc63c8737629e6e282303aebfd5dd96f07e21ae2e7a8b2bdfadd445bd1d71dfdd9745c95b0eb05dc01f289ad765' 
 
     """
+    __slots__ = ('tf', 'buf', 'buflen', 'digest_bits', 'digest_size')
+
     block_size = 64
     block_bits = 512
+    tree_info = 0 # sequential hashing
     block_type = {'key':       0,
                   'nonce':     0x5400000000000000,
                   'msg':       0x7000000000000000,
@@ -61,18 +159,23 @@ class Skein512(object):
     def __init__(self, msg='', digest_bits=512, key=None,
                  block_type='msg'):
         self.tf = Threefish512()
+        self.buf = bytearray(64)
         if key:
             self.digest_bits = 512
             self._start_new_type('key')
-            self.update(key)
-            self.tf.key = bytes2words(self.final(False))
+            Skein512.update(self, key)
+            Skein512._finish(self)
         self.digest_bits = digest_bits
         self.digest_size = (digest_bits + 7) >> 3
-        self._start_new_type('cfg_final')
-        b = words2bytes((0x133414853,digest_bits,0,0,0,0,0,0))
-        self._process_block(b,32)
+        if key or self.tree_info:
+            self._start_new_type('cfg_final')
+            b = words2bytes((0x133414853,digest_bits,self.tree_info,
+                             0,0,0,0,0))
+            self._process_block(b,32)
+        else:
+            self.tf.key = _config_iv(digest_bits)
         self._start_new_type(block_type)
-        if msg:
+        if msg is not None and len(msg):
             self.update(msg)
 
     def _start_new_type(self, block_type):
@@ -81,44 +184,123 @@ class Skein512(object):
         Primarily for internal use.
         
         """
-        self.buf = empty_bytes
-        self.tf.tweak = words([0, self.block_type[block_type]])
+        self.buflen = 0
+        self.tf.tweak = (0, self.block_type[block_type])
 
     def _process_block(self, block, byte_count_add):
         """Encrypt internal state using Threefish.
 
+        `block` may be any object supporting the buffer protocol, and
+        is read in place 64 bytes at a time by ``ubi``.
+
         Primarily for internal use.
         
         """
-        block_len = len(block)
-        for i in xrange(0,block_len,64):
-            w = bytes2words(block[i:i+64])
-            self.tf.tweak[0] = add64(self.tf.tweak[0], byte_count_add)
-            self.tf.prepare_tweak()
-            self.tf.prepare_key()
-            self.tf.key = self.tf.encrypt_block(w)
-            self.tf._feed_forward(self.tf.key, w)
-            # set second tweak value to ~SKEIN_T1_FLAG_FIRST:
-            self.tf.tweak[1] &= bigint(0xbfffffffffffffff)
+        tf = self.tf
+        tf.key, tf.tweak = ubi(tf.key, tf.tweak, block, byte_count_add)
 
     def update(self, msg):
         """Update internal state with new data to be hashed.
 
         `msg` is a bytestring, and should be a bytes object in Python 3
-        and up, or simply a string in Python 2.5 and 2.6.
+        and up, or simply a string in Python 2.5 and 2.6. Any other
+        object supporting the buffer protocol, such as a ``bytearray``
+        or ``memoryview``, may be passed as well and is read without
+        being copied.
+
+        Full blocks are processed straight from `msg`; only the last
+        (possibly partial) block is kept in a fixed 64-byte buffer, as
+        it must be processed differently if it ends the message.
 
         """
-        self.buf += msg
-        buflen = len(self.buf)
-        if buflen > 64:
-            end = -(buflen % 64) or (buflen-64)
-            data = self.buf[0:end]
-            self.buf = self.buf[end:]
-            try:
-                self._process_block(data, 64)
-            except:
-                print(len(data))
-                print(binascii.b2a_hex(data))
+        msg = _byte_view(msg)
+        buf = self.buf
+        buflen = self.buflen
+        msglen = len(msg)
+        if buflen + msglen <= 64:
+            buf[buflen:buflen+msglen] = msg
+            self.buflen = buflen + msglen
+            return
+        if buflen:
+            fill = 64 - buflen
+            buf[buflen:] = msg[:fill]
+            self._process_block(buf, 64)
+            msg = msg[fill:]
+            msglen -= fill
+        # keep between 1 and 64 bytes back for the buffer
+        end = msglen - ((msglen - 1) % 64 + 1)
+        if end:
+            self._process_block(msg[:end], 64)
+        buf[:msglen-end] = msg[end:]
+        self.buflen = msglen - end
+
+    def update_from(self, fileobj, chunk_size=65536):
+        """Update internal state with everything read from `fileobj`.
+
+        `fileobj` is a file-like object opened in binary mode. Data is
+        read `chunk_size` bytes at a time into one reusable buffer
+        (using ``readinto`` if `fileobj` has it), so memory use does
+        not depend on the size of the file.
+
+        """
+        readinto = getattr(fileobj, 'readinto', None)
+        if readinto is None:
+            while True:
+                data = fileobj.read(chunk_size)
+                if not data:
+                    break
+                self.update(data)
+            return
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        while True:
+            n = readinto(buf)
+            if not n:
+                break
+            self.update(view[:n])
+
+    def copy(self):
+        """Return a copy of the hash object.
+
+        The copy has the same internal state, including any data
+        passed to ``update`` so far, and may be updated independently.
+
+        """
+        other = self.__class__.__new__(self.__class__)
+        for name in _slot_names(self.__class__):
+            value = getattr(self, name, _unset)
+            if value is not _unset:
+                setattr(other, name, value)
+        other.tf = self.tf.copy()
+        other.buf = bytearray(self.buf)
+        return other
+
+    def getstate(self):
+        """Return the internal state of the hash object as a bytestring.
+
+        Together with ``setstate``, this allows checkpointing a hash of
+        data that is still growing, and resuming it later (perhaps in
+        another process) without hashing everything again.
+
+        """
+        tf = self.tf
+        return (_state_format.pack(*(list(tf.key[:8]) + list(tf.tweak[:2]) +
+                                     [self.digest_bits, self.digest_size,
+                                      self.buflen])) +
+                bytes(self.buf[:self.buflen]))
+
+    def setstate(self, state):
+        """Restore internal state saved by ``getstate``."""
+        size = _state_format.size
+        values = _state_format.unpack(state[:size])
+        buflen = values[12]
+        if buflen > 64 or len(state) != size + buflen:
+            raise ValueError("invalid Skein512 state")
+        self.tf.key = values[:8]
+        self.tf.tweak = values[8:10]
+        self.digest_bits, self.digest_size = values[10:12]
+        self.buf[:buflen] = state[size:]
+        self.buflen = buflen
 
     def final(self, output=True):
         """Return hashed data as bytestring.
@@ -128,31 +310,47 @@ class Skein512(object):
 
         This function can be called as either ``final`` or ``digest``.
         
+        """
+        self._finish()
+        if not output:
+            return words2bytes(self.tf.key[:8])
+        return self._output()
+
+    def _finish(self):
+        """Process the buffered data as the end of the message.
+
+        This leaves the final chaining value in ``tf.key``, ready for
+        the output stage.
+
+        Primarily for internal use.
+
         """
         self.tf.tweak[1] |= bigint(0x8000000000000000) # SKEIN_T1_FLAG_FINAL
-        buflen = len(self.buf)
-        self.buf += zero_bytes[:64-buflen]
+        buflen = self.buflen
+        self.buf[buflen:] = zero_bytes[:64-buflen]
 
         self._process_block(self.buf, buflen)
+        self.buflen = 64
 
-        if not output:
-            hash_val = words2bytes(self.tf.key)
+    def _output(self):
+        """Return `digest_size` bytes from the output stage.
+
+        Primarily for internal use.
+
+        """
+        count = (self.digest_size + 63) // 64
+        self.buf[:] = zero_bytes
+        if count == 1:
+            output = words2bytes(ubi(self.tf.key,
+                                     [0, self.block_type['out_final']],
+                                     self.buf, 8)[0])
         else:
-            hash_val = empty_bytes
-            self.buf = zero_bytes[:]
-            key = self.tf.key[:] # temporary copy
-            i=0
-            while i*64 < self.digest_size:
-                self.buf = words_format[1].pack(i) + self.buf[8:]
-                self.tf.tweak = [0, self.block_type['out_final']]
-                self._process_block(self.buf, 8)
-                n = self.digest_size - i*64
-                if n >= 64:
-                    n = 64
-                hash_val += words2bytes(self.tf.key)[0:n]
-                self.tf.key = key
-                i+=1
-        return hash_val
+            output = Skein512Output(self.tf.key).blocks(0, count)
+            words_format[1].pack_into(self.buf, 0, count - 1)
+        # leave the same state behind as processing the last output
+        # block in place would, since Skein512Random carries on from it
+        self.tf.tweak = (8, self.block_type['out_final'] & 0xbfffffffffffffff)
+        return output[:self.digest_size]
 
     digest = final
 
@@ -160,6 +358,402 @@ class Skein512(object):
         """Return a hexadecimal representation of the hashed data"""
         return binascii.b2a_hex(self.digest())
 
+    def xof(self):
+        """Finish hashing and return a ``Skein512Output`` for reading.
+
+        Use this instead of ``final`` when the output is very long, or
+        its length is not known in advance. The first `digest_bits` / 8
+        bytes read are the same as ``final`` would return, and reading
+        continues past them as far as needed. (`digest_bits` is part of
+        the hash configuration, so it must still be chosen up front.)
+
+        """
+        self._finish()
+        return Skein512Output(list(self.tf.key[:8]))
+
+
+class Skein512Output(object):
+    """Extendable output from the Skein 512-bit output stage.
+
+    `chain` is the final chaining value (8 words) of a hash. Output
+    block i is produced by Threefish-encrypting the counter value i
+    under `chain`, so blocks may be read in any order with ``seek``,
+    and only the block being read is kept in memory. ``blocks`` returns
+    a range of blocks at once; the blocks do not depend on each other,
+    so they are generated with the "bulk" backend (see
+    ``geesefly.backends``), and separate ranges may be handed to
+    separate threads or processes.
+
+    Iterating over a ``Skein512Output`` yields 64-byte blocks without
+    end.
+
+    """
+    __slots__ = ('tf', 'position')
+
+    def __init__(self, chain, position=0):
+        self.tf = Threefish512()
+        self.tf.key = chain[:8]
+        self.tf.prepare_key()
+        self.tf.tweak = (8, Skein512.block_type['out_final'])
+        self.tf.prepare_tweak()
+        self.position = position
+
+    def blocks(self, start, count):
+        """Return `count` output blocks from block `start` as bytes."""
+        pack = words_format[8].pack
+        counters = empty_bytes.join(pack(i, 0, 0, 0, 0, 0, 0, 0)
+                                    for i in xrange(start, start + count))
+        output = get_backend('bulk').encrypt_blocks(self.tf.schedule.subkeys,
+                                                    counters)
+        return xor_bytes(output, counters)
+
+    def read(self, n):
+        """Return the next `n` bytes of output."""
+        position = self.position
+        first = position // 64
+        count = (position + n + 63) // 64 - first
+        offset = position - first * 64
+        self.position = position + n
+        return self.blocks(first, count)[offset:offset + n]
+
+    def seek(self, position):
+        """Move to byte `position` of the output."""
+        self.position = position
+
+    def tell(self):
+        """Return the current byte position in the output."""
+        return self.position
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.read(64)
+
+    __next__ = next
+
+def hash_file(path, digest_bits=512, key=None):
+    """Return the Skein 512-bit digest of the file at `path`.
+
+    Regular files are memory mapped and hashed in place where
+    ``mmap`` is available; otherwise the file is read in chunks using
+    ``Skein512.update_from``. Either way, the file is never read into
+    memory as a whole.
+
+    """
+    hasher = Skein512(digest_bits=digest_bits, key=key)
+    f = open(path, 'rb')
+    try:
+        mapped = None
+        if mmap is not None:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (ValueError, EnvironmentError): # empty or not mappable
+                pass
+        if mapped is None:
+            hasher.update_from(f)
+        else:
+            try:
+                hasher.update(mapped)
+            except TypeError: # no buffer interface for mmap in Python 2
+                hasher.update_from(f)
+            finally:
+                mapped.close()
+    finally:
+        f.close()
+    return hasher.digest()
+
+def skein512_many(messages, digest_bits=512, key=None):
+    """Return a list of Skein 512-bit digests, one for each message.
+
+    The result is the same as hashing each message separately with
+    ``Skein512(msg, digest_bits, key)``, but messages with the same
+    number of blocks are hashed side by side, so the cost of each
+    Threefish step is shared across all of them. This is done with NumPy
+    arrays, or without NumPy by packing the messages into Python
+    integers (see ``geesefly.swar``), depending on the "bulk" backend.
+    With any other backend, the messages are simply hashed one at a
+    time.
+
+    """
+    messages = [_byte_view(msg) for msg in messages]
+    bulk = get_backend('bulk').name
+    if bulk == 'numpy':
+        hash_group = _hash_group_numpy
+    elif bulk == 'swar':
+        hash_group = _hash_group_swar
+    else:
+        return [Skein512(msg, digest_bits, key).digest() for msg in messages]
+    start = Skein512(digest_bits=digest_bits, key=key)
+    digest_size = start.digest_size
+    out_blocks = (digest_size + 63) // 64
+
+    groups = {}
+    for index, msg in enumerate(messages):
+        groups.setdefault(max(1, (len(msg) + 63) // 64), []).append(index)
+
+    digests = [None] * len(messages)
+    for blocks, indexes in groups.items():
+        outputs = hash_group(start.tf.key[:8],
+                             [messages[index] for index in indexes],
+                             blocks, out_blocks)
+        for index, output in izip(indexes, outputs):
+            digests[index] = output[:digest_size]
+    return digests
+
+def _message_tweaks(blocks):
+    """Yield the tweak word t1 and final flag for each message block.
+
+    Primarily for internal use.
+
+    """
+    for j in xrange(blocks):
+        t1 = Skein512.block_type['msg']
+        if j: # clear SKEIN_T1_FLAG_FIRST
+            t1 &= 0xbfffffffffffffff
+        if j == blocks - 1:
+            t1 |= 0x8000000000000000 # SKEIN_T1_FLAG_FINAL
+        yield j, t1, j == blocks - 1
+
+def _hash_group_numpy(chain, messages, blocks, out_blocks):
+    """Return `out_blocks` of output for each message, using NumPy.
+
+    All `messages` are `blocks` blocks long, once padded, and start
+    from the chaining value `chain`.
+
+    Primarily for internal use.
+
+    """
+    from . import util_numpy
+    np = util_numpy.np
+    rows = len(messages)
+    data = np.zeros((rows, blocks * 64), dtype=np.uint8)
+    lengths = np.empty(rows, dtype=np.uint64)
+    for row, msg in enumerate(messages):
+        msg = np.frombuffer(msg, dtype=np.uint8)
+        data[row, :len(msg)] = msg
+        lengths[row] = len(msg)
+    data = data.view(util_numpy.block_dtype).reshape(rows, blocks, 8)
+    data = data.astype(np.uint64)
+
+    chain = np.array([chain] * rows, dtype=np.uint64)
+    tweak = np.empty((rows, 2), dtype=np.uint64)
+    for j, t1, final in _message_tweaks(blocks):
+        if final:
+            tweak[:, 0] = lengths
+        else:
+            tweak[:, 0] = (j + 1) * 64
+        tweak[:, 1] = t1
+        block = data[:, j]
+        chain = util_numpy.encrypt_blocks(
+            block, util_numpy.expand_key(chain, tweak))
+        chain ^= block
+
+    output = np.empty((rows, out_blocks, 8), dtype=np.uint64)
+    tweak[:, 0] = 8
+    tweak[:, 1] = Skein512.block_type['out_final']
+    subkeys = util_numpy.expand_key(chain, tweak)
+    for i in xrange(out_blocks):
+        block = np.zeros((rows, 8), dtype=np.uint64)
+        block[:, 0] = i
+        output[:, i] = util_numpy.encrypt_blocks(block, subkeys) ^ block
+    output = output.astype(util_numpy.block_dtype).tobytes()
+    size = out_blocks * 64
+    return [output[row*size:(row+1)*size] for row in xrange(rows)]
+
+def _hash_group_swar(chain, messages, blocks, out_blocks):
+    """Return `out_blocks` of output for each message, using ``swar``.
+
+    Takes the same arguments as ``_hash_group_numpy``.
+
+    Primarily for internal use.
+
+    """
+    from . import swar
+    outputs = []
+    size = blocks * 64
+    def padded(msg):
+        block = bytearray(size)
+        block[:len(msg)] = msg
+        return bytes(block)
+    for first in xrange(0, len(messages), swar.MAX_LANES):
+        group = [padded(msg) for msg in messages[first:first + swar.MAX_LANES]]
+        lanes = swar.lanes(len(group))
+        lengths = lanes.pack_values([len(msg) for msg in
+                                     messages[first:first + lanes.count]])
+        state = lanes.replicate(chain)
+        for j, t1, final in _message_tweaks(blocks):
+            block = lanes.pack(empty_bytes.join(msg[j*64:(j+1)*64]
+                                                for msg in group))
+            if final:
+                t0 = lengths
+            else:
+                t0 = (j + 1) * 64 * lanes.ones
+            subkeys = lanes.expand_key(state, [t0, t1 * lanes.ones])
+            state = [x ^ m for x, m in
+                     izip(lanes.encrypt(subkeys, block), block)]
+
+        subkeys = lanes.expand_key(state, lanes.replicate(
+            [8, Skein512.block_type['out_final']]))
+        output = []
+        for i in xrange(out_blocks):
+            counter = lanes.replicate([i, 0, 0, 0, 0, 0, 0, 0])
+            output.append(lanes.unpack([x ^ c for x, c in izip(
+                lanes.encrypt(subkeys, counter), counter)]))
+        outputs.extend(empty_bytes.join(block[row*64:(row+1)*64]
+                                        for block in output)
+                       for row in xrange(lanes.count))
+    return outputs
+
+def _ubi_node(args):
+    """Return the 64-byte chaining value from hashing one tree node.
+
+    `args` is a tuple of the starting chaining value, the starting
+    tweak and the node's data, which is processed as a complete UBI
+    message. This is a plain function so that it can be handed to a
+    ``multiprocessing`` pool.
+
+    Primarily for internal use.
+
+    """
+    key, tweak, data = args
+    n = len(data)
+    end = n and n - ((n - 1) % 64 + 1)
+    key, tweak = ubi(key, tweak, data[:end], 64)
+    last = bytearray(64)
+    last[:n-end] = data[end:]
+    tweak[1] |= bigint(0x8000000000000000) # SKEIN_T1_FLAG_FINAL
+    return words2bytes(ubi(key, tweak, last, n - end)[0])
+
+class Skein512Tree(Skein512):
+    """Skein 512-bit hashing algorithm in tree mode
+
+    The message is split into leaves of ``64 * 2**leaf_log`` bytes,
+    which are hashed independently of each other. Their results are
+    then combined in nodes of ``2**fan_out_log`` children, level by
+    level, until one value remains or `max_height` levels are reached,
+    as described in the Skein specification. The tree parameters are
+    part of the configuration block, so each choice of them yields
+    different digests, which also differ from those of ``Skein512``.
+    Unlike ``Skein512``, keyed tree hashes also follow the
+    specification, with the first-block flag set for the key.
+
+    Leaves are hashed as soon as they are complete. If `pool` is given
+    (typically a ``multiprocessing.Pool``, but any object with a
+    ``map`` method will do), batches of `pool_batch` leaves are hashed
+    in parallel through it.
+
+    `msg`, `digest_bits` and `key` are the same as for ``Skein512``.
+
+    """
+    __slots__ = ('tree_info', 'leaf_size', 'node_size', 'max_height', 'pool',
+                 'pool_batch', 'pending', 'leaves')
+
+    block_type = dict(Skein512.block_type, key=0x4000000000000000)
+
+    def __init__(self, msg='', digest_bits=512, key=None, leaf_log=10,
+                 fan_out_log=1, max_height=255, pool=None, pool_batch=16):
+        if not (0 < leaf_log < 256 and 0 < fan_out_log < 256 and
+                1 < max_height < 256):
+            raise ValueError("invalid tree parameters")
+        self.tree_info = leaf_log | fan_out_log << 8 | max_height << 16
+        self.leaf_size = 64 << leaf_log
+        self.node_size = 64 << fan_out_log
+        self.max_height = max_height
+        self.pool = pool
+        self.pool_batch = pool_batch
+        self.pending = bytearray()
+        self.leaves = []
+        Skein512.__init__(self, msg, digest_bits, key)
+
+    def _hash_nodes(self, data, node_size, level, position=0):
+        """Return the concatenated chaining values of the nodes in `data`.
+
+        Primarily for internal use.
+
+        """
+        key = tuple(self.tf.key[:8])
+        t1 = self.block_type['msg'] | level << 48
+        tasks = [(key, [position + i, t1], bytes(data[i:i+node_size]))
+                 for i in xrange(0, len(data) or 1, node_size)]
+        if self.pool is not None and len(tasks) > 1:
+            return list(self.pool.map(_ubi_node, tasks))
+        return [_ubi_node(task) for task in tasks]
+
+    def update(self, msg):
+        """Update internal state with new data to be hashed."""
+        self.pending.extend(msg)
+        batch = self.leaf_size
+        if self.pool is not None:
+            batch *= self.pool_batch
+        if len(self.pending) >= batch:
+            end = len(self.pending) - len(self.pending) % self.leaf_size
+            self.leaves.extend(self._hash_nodes(
+                self.pending[:end], self.leaf_size, 1,
+                len(self.leaves) * self.leaf_size))
+            del self.pending[:end]
+
+    def getstate(self):
+        """Return the internal state of the hash object as a bytestring.
+
+        This includes the chaining values of the leaves hashed so far
+        and the data not yet hashed, so its size grows with the
+        message. It can only be restored into a tree hash with the same
+        tree parameters.
+
+        """
+        head = Skein512.getstate(self)
+        return (_tree_state_format.pack(len(head), self.tree_info,
+                                        len(self.leaves)) +
+                head + empty_bytes.join(self.leaves) + bytes(self.pending))
+
+    def setstate(self, state):
+        """Restore internal state saved by ``getstate``."""
+        size = _tree_state_format.size
+        head_size, tree_info, count = _tree_state_format.unpack(state[:size])
+        if tree_info != self.tree_info:
+            raise ValueError("Skein512Tree state has other tree parameters")
+        start = size + head_size
+        if len(state) < start + 64 * count:
+            raise ValueError("invalid Skein512Tree state")
+        Skein512.setstate(self, state[size:start])
+        self.leaves = [bytes(state[i:i+64])
+                       for i in xrange(start, start + 64 * count, 64)]
+        self.pending = bytearray(state[start + 64 * count:])
+
+    def copy(self):
+        """Return a copy of the hash object."""
+        other = Skein512.copy(self)
+        other.pending = bytearray(self.pending)
+        other.leaves = self.leaves[:]
+        return other
+
+    def _finish(self):
+        """Hash the remaining leaves and the nodes above them.
+
+        This leaves the root chaining value in ``tf.key``, ready for
+        the output stage.
+
+        Primarily for internal use.
+
+        """
+        if self.pending or not self.leaves:
+            self.leaves.extend(self._hash_nodes(
+                self.pending, self.leaf_size, 1,
+                len(self.leaves) * self.leaf_size))
+            del self.pending[:]
+        level = 1
+        data = empty_bytes.join(self.leaves)
+        while len(data) > 64:
+            level += 1
+            if level == self.max_height:
+                data = self._hash_nodes(data, len(data), level)[0]
+            else:
+                data = empty_bytes.join(
+                    self._hash_nodes(data, self.node_size, level))
+        self.tf.key = bytes2words(data)
+        self.leaves = []
+
 class Skein512Random(Skein512):
     """A Skein-based pseudo-random bytestring generator.
     
@@ -168,14 +762,21 @@ class Skein512Random(Skein512):
 
     In case you are using this as an iterator, rather than generating
     new data at each iteration, a pool of length `queue_size` is
-    generated periodically.
+    generated periodically. The integer, float and buffer methods
+    likewise draw from a pool of `pool_size` bytes, which is refilled
+    with a single call to ``getbytes`` whenever it runs dry.
     
     """
-    def __init__(self, seed=None, queue_size=512):
+    __slots__ = ('queue', 'queue_size', 'pool', 'pool_pos', 'pool_size')
+
+    def __init__(self, seed=None, queue_size=512, pool_size=4096):
         Skein512.__init__(self, block_type='nonce')
         self.queue = []
         self.queue_size = queue_size
-        self.tf.key = zero_words[:]
+        self.pool = empty_bytes
+        self.pool_pos = 0
+        self.pool_size = pool_size
+        self.tf.key = zero_words
         if not seed:
           seed = os.urandom(100)
         self.reseed(seed)
@@ -183,17 +784,120 @@ class Skein512Random(Skein512):
     def reseed(self, seed):
         """(Re)seed the generator."""
         self.digest_size = 64
-        self.update(words2bytes(self.tf.key) + seed)
+        self.update(words2bytes(self.tf.key[:8]) + seed)
         self.tf.key = bytes2words(self.final())
+        self.queue = []
+        self.pool = empty_bytes
+        self.pool_pos = 0
+
+    def copy(self):
+        """Return a copy of the generator, with its own queue and pool.
+
+        Both continue with the same output.
+
+        """
+        other = Skein512.copy(self)
+        other.queue = array.array('B', self.queue)
+        return other
+
+    def getstate(self):
+        """Return the state of the generator as a bytestring.
+
+        It includes any unused bytes of the pool and queue, so a
+        generator restored with ``setstate`` continues exactly where
+        this one was.
+
+        """
+        head = Skein512.getstate(self)
+        queue = bytes(bytearray(self.queue))
+        return (_random_state_format.pack(len(head), len(queue),
+                                          self.pool_pos, self.queue_size,
+                                          self.pool_size) +
+                head + queue + bytes(self.pool))
+
+    def setstate(self, state):
+        """Restore the state saved by ``getstate``."""
+        size = _random_state_format.size
+        (head_size, queue_length, pool_pos, self.queue_size,
+         self.pool_size) = _random_state_format.unpack(state[:size])
+        start = size + head_size
+        if len(state) < start + queue_length:
+            raise ValueError("invalid Skein512Random state")
+        Skein512.setstate(self, state[size:start])
+        self.queue = array.array('B', state[start:start + queue_length])
+        self.pool = bytes(state[start + queue_length:])
+        self.pool_pos = pool_pos
 
     def getbytes(self, request_bytes):
-        """Return random bytestring of length `request_bytes`."""
+        """Return random bytestring of length `request_bytes`.
+
+        The whole request is produced by one pass through the output
+        stage, so asking for many bytes at once is much cheaper than
+        asking for a few bytes many times.
+
+        """
         self.digest_size = 64 + request_bytes
-        self.update(words2bytes(self.tf.key))
+        self.update(words2bytes(self.tf.key[:8]))
         output = self.final()
         self.tf.key = bytes2words(output[0:64])
         return output[64:]
 
+    def _take(self, n):
+        """Return `n` bytes from the pool, refilling it as needed.
+
+        Primarily for internal use.
+
+        """
+        pos = self.pool_pos
+        if pos + n <= len(self.pool):
+            self.pool_pos = pos + n
+            return self.pool[pos:pos + n]
+        rest = self.pool[pos:]
+        n -= len(rest)
+        if n > self.pool_size:
+            self.pool = empty_bytes
+            self.pool_pos = 0
+            return rest + self.getbytes(n)
+        self.pool = self.getbytes(self.pool_size)
+        self.pool_pos = n
+        return rest + self.pool[:n]
+
+    def randbits(self, k):
+        """Return a non-negative integer with `k` random bits."""
+        if k <= 0:
+            return 0
+        nbytes = (k + 7) // 8
+        value = int(binascii.hexlify(self._take(nbytes)), 16)
+        return value >> (nbytes * 8 - k)
+
+    def randint(self, a, b):
+        """Return a random integer N such that ``a <= N <= b``."""
+        span = b - a
+        if span < 0:
+            raise ValueError("empty range for randint(%d, %d)" % (a, b))
+        k = bigint(span).bit_length()
+        value = self.randbits(k)
+        while value > span:
+            value = self.randbits(k)
+        return a + value
+
+    def random(self):
+        """Return a random float in the interval [0.0, 1.0)."""
+        return self.randbits(53) * 1.1102230246251565e-16 # 2 ** -53
+
+    def fill(self, buffer):
+        """Fill the writable `buffer` with random bytes and return it.
+
+        `buffer` may be anything supporting the writable buffer
+        protocol, such as a ``bytearray`` or a contiguous NumPy array.
+
+        """
+        view = memoryview(buffer)
+        if view.ndim != 1 or view.format != 'B':
+            view = view.cast('B')
+        view[:] = self._take(len(view))
+        return buffer
+
     def __iter__(self):
       return self
 
@@ -201,3 +905,139 @@ class Skein512Random(Skein512):
       if not self.queue:
         self.queue = array.array('B', self.getbytes(self.queue_size))
       return self.queue.pop()
+
+    __next__ = next
+
+
+# Every live Skein512SharedRandom, to be reseeded in forked children
+_shared_generators = weakref.WeakSet()
+
+def _reseed_after_fork():
+    """Reseed every shared generator in a new child process.
+
+    Primarily for internal use.
+
+    """
+    for shared in list(_shared_generators):
+        shared._after_fork()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reseed_after_fork)
+
+
+class Skein512SharedRandom(object):
+    """A ``Skein512Random`` that may be shared by threads and processes.
+
+    Each thread draws from its own ``Skein512Random`` with its own pool,
+    seeded from a parent generator the first time the thread asks for
+    data, so no locking is needed after that. In a child process created
+    with ``os.fork`` the parent generator is reseeded from ``os.urandom``
+    and the per-thread generators are replaced, so parent and children
+    never repeat each other's output.
+
+    If `seed` is given, the output of each thread depends on the order in
+    which threads first use the generator.
+
+    """
+    def __init__(self, seed=None, pool_size=4096):
+        self.pool_size = pool_size
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.parent = Skein512Random(seed)
+        self.pid = os.getpid()
+        self.epoch = 0
+        _shared_generators.add(self)
+
+    def _after_fork(self):
+        """Reseed the parent generator in a new child process.
+
+        Primarily for internal use.
+
+        """
+        self.lock = threading.Lock() # may have been held during the fork
+        self.pid = os.getpid()
+        self.parent.reseed(os.urandom(64) + struct.pack('<Q', self.pid))
+        self.epoch += 1
+
+    @property
+    def generator(self):
+        """The ``Skein512Random`` used by the calling thread."""
+        if os.getpid() != self.pid:
+            self._after_fork()
+        local = self.local
+        if getattr(local, 'epoch', None) != self.epoch:
+            with self.lock:
+                seed = self.parent.getbytes(64)
+            local.generator = Skein512Random(seed, pool_size=self.pool_size)
+            local.epoch = self.epoch
+        return local.generator
+
+    def reseed(self, seed):
+        """(Re)seed the parent generator and every thread's generator."""
+        with self.lock:
+            self.parent.reseed(seed)
+            self.epoch += 1
+
+    def getbytes(self, request_bytes):
+        """Return random bytestring of length `request_bytes`."""
+        return self.generator.getbytes(request_bytes)
+
+    def randbits(self, k):
+        """Return a non-negative integer with `k` random bits."""
+        return self.generator.randbits(k)
+
+    def randint(self, a, b):
+        """Return a random integer N such that ``a <= N <= b``."""
+        return self.generator.randint(a, b)
+
+    def random(self):
+        """Return a random float in the interval [0.0, 1.0)."""
+        return self.generator.random()
+
+    def fill(self, buffer):
+        """Fill the writable `buffer` with random bytes and return it."""
+        return self.generator.fill(buffer)
+
+
+class SkeinRandom(random.Random):
+    """A ``random.Random`` whose numbers come from ``Skein512Random``.
+
+    All of the usual methods (``randint``, ``choice``, ``shuffle``,
+    ``gauss`` and so on) are available. `seed` may be an integer, a
+    string or a bytestring; if it is unspecified, ``os.urandom`` is
+    used. ``getstate`` and ``setstate`` save and restore the generator,
+    so instances can also be copied and pickled.
+
+    """
+    def __init__(self, seed=None, pool_size=4096):
+        self.pool_size = pool_size
+        random.Random.__init__(self, seed)
+
+    def seed(self, a=None, version=2):
+        """Start a new ``Skein512Random`` generator seeded with `a`."""
+        if a is not None and not isinstance(a, bytes):
+            if not isinstance(a, str):
+                a = repr(a)
+            a = a.encode('utf-8')
+        self.generator = Skein512Random(a, pool_size=self.pool_size)
+        self.gauss_next = None
+
+    def random(self):
+        """Return a random float in the interval [0.0, 1.0)."""
+        return self.generator.random()
+
+    def getrandbits(self, k):
+        """Return a non-negative integer with `k` random bits."""
+        return self.generator.randbits(k)
+
+    def getstate(self):
+        """Return an object capturing the current state of the generator."""
+        return ('SkeinRandom', self.generator.getstate(), self.gauss_next)
+
+    def setstate(self, state):
+        """Restore the state returned by ``getstate``."""
+        if len(state) != 3 or state[0] != 'SkeinRandom':
+            raise ValueError("state is not from a SkeinRandom")
+        self.generator.setstate(state[1])
+        self.pool_size = self.generator.pool_size
+        self.gauss_next = state[2]
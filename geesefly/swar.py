@@ -0,0 +1,221 @@
+# /usr/bin/env python
+# coding=utf-8
+
+#  Copyright 2010 Jonathan Bowman
+#
+#  Licensed under the Apache License, Version 2.0 (the "License");
+#  you may not use this file except in compliance with the License.
+#  You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+#  Unless required by applicable law or agreed to in writing, software
+#  distributed under the License is distributed on an "AS IS" BASIS,
+#  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or
+#  implied. See the License for the specific language governing
+#  permissions and limitations under the License.
+
+"""Threefish on many blocks at once, packed side by side in Python integers
+
+Word y of N independent blocks is packed into a single integer, with
+block i in "lane" i: bits 72*i to 72*i+63. The 8 bits between lanes are
+guard bits, which catch the carry out of an addition (or stand in for
+the borrow of a subtraction) and are then masked off, so every addition,
+subtraction, XOR and rotation of the packed integers works on all N
+blocks in one interpreter operation. This needs nothing but Python
+itself.
+
+"""
+
+from __future__ import absolute_import
+
+import binascii
+import types
+
+from .util import max64, SKEIN_KS_PARITY, words_format, xrange, zero_bytes
+
+LANE_BYTES = 9
+
+# How many blocks to pack together at most. Larger integers gain little
+# more speed, and need more memory.
+MAX_LANES = 128
+
+try:
+    int.from_bytes
+except AttributeError: # Python 2
+    def _to_int(data):
+        if not data:
+            return 0
+        return int(binascii.hexlify(bytes(data[::-1])), 16)
+
+    def _to_bytes(value, length):
+        return binascii.unhexlify('%0*x' % (2 * length, value))[::-1]
+else:
+    def _to_int(data):
+        return int.from_bytes(data, 'little')
+
+    def _to_bytes(value, length):
+        return value.to_bytes(length, 'little')
+
+class Lanes(object):
+    """Masks and packed functions for a given number of lanes.
+
+    Primarily for internal use.
+
+    """
+    def __init__(self, count):
+        from .threefish import ROT
+        self.count = count
+        ones = _to_int(bytearray([1] + [0] * (LANE_BYTES - 1)) * count)
+        self.ones = ones
+        namespace = {'M': max64 * ones, 'H': (max64 + 1) * ones}
+        for r in set(ROT) | set(64 - r for r in ROT):
+            namespace['hi%d' % r] = ((max64 << r) & max64) * ones
+            namespace['lo%d' % r] = ((1 << r) - 1) * ones
+        self.mask = namespace['M']
+        encrypt, decrypt = _build_functions()
+        self.encrypt = types.FunctionType(encrypt.__code__, namespace)
+        self.decrypt = types.FunctionType(decrypt.__code__, namespace)
+
+    def pack(self, data):
+        """Return the 8 packed words of the blocks in bytestring `data`."""
+        words = []
+        size = self.count * LANE_BYTES
+        for y in xrange(8):
+            lanes = bytearray(size)
+            for j in xrange(8):
+                lanes[j::LANE_BYTES] = data[8*y+j::64]
+            words.append(_to_int(lanes))
+        return words
+
+    def unpack(self, words):
+        """Return the blocks in the 8 packed `words` as a bytestring."""
+        data = bytearray(self.count * 64)
+        size = self.count * LANE_BYTES
+        for y in xrange(8):
+            lanes = _to_bytes(words[y], size)
+            for j in xrange(8):
+                data[8*y+j::64] = lanes[j::LANE_BYTES]
+        return bytes(data)
+
+    def pack_values(self, values):
+        """Return one packed word holding a 64-bit value for each lane."""
+        pack = words_format[1].pack
+        return _to_int(zero_bytes[:0].join(pack(value) + zero_bytes[:1]
+                                           for value in values))
+
+    def replicate(self, values):
+        """Return packed words with every lane holding `values`."""
+        ones = self.ones
+        return [value * ones for value in values]
+
+    def expand_key(self, key, tweak):
+        """Return packed subkeys for packed `key` (8) and `tweak` (2)."""
+        mask = self.mask
+        key = list(key[:8])
+        parity = SKEIN_KS_PARITY * self.ones
+        for word in key:
+            parity ^= word
+        key.append(parity)
+        tweak = [tweak[0], tweak[1], tweak[0] ^ tweak[1]]
+        subkeys = []
+        for s in xrange(19):
+            for y in xrange(8):
+                word = key[(s + y) % 9]
+                if y == 5:
+                    word += tweak[s % 3]
+                elif y == 6:
+                    word += tweak[(s + 1) % 3]
+                elif y == 7:
+                    word += s * self.ones
+                subkeys.append(word & mask)
+        return subkeys
+
+_built = []
+
+def _build_functions():
+    """Return generated packed encrypt and decrypt functions.
+
+    They refer to the masks by name (``M``, ``H``, ``hi46``, ``lo46``
+    and so on), so the same code serves any number of lanes once it is
+    given the right globals.
+
+    Primarily for internal use.
+
+    """
+    if _built:
+        return _built
+    from .threefish import _compile, PERM, ROT
+
+    def rotl(x, r):
+        return '((%s << %d) & hi%d | (%s >> %d) & lo%d)' % (x, r, r,
+                                                           x, 64 - r, r)
+    head = ['x0, x1, x2, x3, x4, x5, x6, x7 = block']
+    tail = ['return [x0, x1, x2, x3, x4, x5, x6, x7]']
+
+    enc = ['x%d = (x%d + ks[%d]) & M' % (y, y, y) for y in xrange(8)]
+    for r in xrange(1, 19):
+        s = 16 * ((r - 1) % 2)
+        for i in xrange(16):
+            m, n = PERM[i]
+            enc.append('x%d = (x%d + x%d) & M' % (m, m, n))
+            enc.append('x%d = %s ^ x%d' % (n, rotl('x%d' % n, ROT[i+s]), m))
+        enc.extend('x%d = (x%d + ks[%d]) & M' % (y, y, r * 8 + y)
+                   for y in xrange(8))
+
+    dec = []
+    for r in xrange(18, 0, -1):
+        s = 16 * ((r - 1) % 2)
+        dec.extend('x%d = ((x%d | H) - ks[%d]) & M' % (y, y, r * 8 + y)
+                   for y in xrange(8))
+        for i in xrange(15, -1, -1):
+            m, n = PERM[i]
+            dec.append('x%d ^= x%d' % (n, m))
+            dec.append('x%d = %s' % (n, rotl('x%d' % n, 64 - ROT[i+s])))
+            dec.append('x%d = ((x%d | H) - x%d) & M' % (m, m, n))
+    dec.extend('x%d = ((x%d | H) - ks[%d]) & M' % (y, y, y)
+               for y in xrange(8))
+
+    _built.extend([_compile('encrypt', 'ks, block', head + enc + tail),
+                   _compile('decrypt', 'ks, block', head + dec + tail)])
+    return _built
+
+_lanes = {}
+
+def lanes(count):
+    """Return the ``Lanes`` for `count` blocks, reusing earlier ones."""
+    if count not in _lanes:
+        _lanes[count] = Lanes(count)
+    return _lanes[count]
+
+def _crypt_blocks(subkeys, data, decrypt):
+    """En/decrypt the blocks in `data` with one shared set of subkeys.
+
+    Primarily for internal use.
+
+    """
+    output = []
+    total = len(data) // 64
+    for first in xrange(0, total, MAX_LANES):
+        lane_set = lanes(min(MAX_LANES, total - first))
+        function = decrypt and lane_set.decrypt or lane_set.encrypt
+        chunk = data[first * 64:(first + lane_set.count) * 64]
+        output.append(lane_set.unpack(function(lane_set.replicate(subkeys),
+                                               lane_set.pack(chunk))))
+    return zero_bytes[:0].join(output)
+
+def encrypt_blocks(subkeys, data):
+    """Return the blocks in bytestring `data`, encrypted with `subkeys`.
+
+    `subkeys` is the flat tuple of 152 words from a ``KeySchedule``.
+
+    """
+    return _crypt_blocks(subkeys, data, False)
+
+def decrypt_blocks(subkeys, data):
+    """Return the blocks in bytestring `data`, decrypted with `subkeys`.
+
+    `subkeys` is the flat tuple of 152 words from a ``KeySchedule``.
+
+    """
+    return _crypt_blocks(subkeys, data, True)
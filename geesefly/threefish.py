@@ -22,22 +22,17 @@ The core of the Skein 512-bit hashing algorithm
 """
 from __future__ import absolute_import
 
-try:
-    from .util_numpy import (add64, bigint, bytelist, bytes2words, imap, izip,
-                             sub64, SKEIN_KS_PARITY, words, words2bytes, words_format, xrange,
-                             zero_bytes, zero_words, RotL_64, RotR_64, xor)
-except ImportError:
-    from .util import (add64, bigint, bytelist, bytes2words, imap, izip,
-                       sub64, SKEIN_KS_PARITY, words, words2bytes, words_format, xrange,
-                       zero_bytes, zero_words, RotL_64, RotR_64, xor)
+from .backends import get_backend
+from .util import (add64, bigint, bytelist, bytes2words, imap, izip, max64,
+                   sub64, SKEIN_KS_PARITY, word_array, words, words2bytes,
+                   words_format, xrange, zero_bytes, zero_words, RotL_64,
+                   RotR_64, xor)
 
 try:
     reduce
 except NameError:
     from functools import reduce
 
-from itertools import cycle
-
 ROT = bytelist((46, 36, 19, 37,
                 33, 27, 14, 42,
                 17, 49, 36, 39,
@@ -52,6 +47,171 @@ PERM = bytelist(((0,1),(2,3),(4,5),(6,7),
                  (4,1),(6,3),(0,5),(2,7),
                  (6,1),(0,7),(2,5),(4,3)))
 
+def _inline_subkey(s, y):
+    """Return an expression computing word `y` of subkey `s` inline."""
+    terms = ['k%d' % ((s + y) % 9)]
+    if y == 5:
+        terms.append('t%d' % (s % 3))
+    elif y == 6:
+        terms.append('t%d' % ((s + 1) % 3))
+    elif y == 7 and s:
+        terms.append('%d' % s)
+    if len(terms) == 1:
+        return terms[0]
+    return '(%s)' % ' + '.join(terms)
+
+def _scheduled_subkey(s, y):
+    """Return an expression looking up word `y` of subkey `s`."""
+    return 'ks[%d]' % (s * 8 + y)
+
+def _round_lines(subkey):
+    """Return source lines for fully unrolled block en/decryption.
+
+    All 72 rounds and 19 subkey injections are written out as straight
+    line code working on local variables ``x0`` to ``x7``, with the
+    rotation constants and permutation folded in, so that no table
+    lookups or helper calls happen while a block is being processed.
+    `subkey` is a function returning the expression for each subkey
+    word.
+
+    Primarily for internal use.
+
+    """
+    def inject(s, op):
+        return ['x%d = (x%d %s %s) & 0x%x' % (y, y, op, subkey(s, y), max64)
+                for y in xrange(8)]
+
+    enc = inject(0, '+')
+    for r in xrange(1, 19):
+        s = 16 * ((r - 1) % 2)
+        for i in xrange(16):
+            m, n = PERM[i]
+            enc.append('x%d = (x%d + x%d) & 0x%x' % (m, m, n, max64))
+            enc.append('x%d = ((x%d << %d) & 0x%x | x%d >> %d) ^ x%d' %
+                       (n, n, ROT[i+s], max64, n, 64 - ROT[i+s], m))
+        enc.extend(inject(r, '+'))
+
+    dec = []
+    for r in xrange(18, 0, -1):
+        s = 16 * ((r - 1) % 2)
+        dec.extend(inject(r, '-'))
+        for i in xrange(15, -1, -1):
+            m, n = PERM[i]
+            dec.append('x%d ^= x%d' % (n, m))
+            dec.append('x%d = (x%d >> %d | x%d << %d) & 0x%x' %
+                       (n, n, ROT[i+s], n, 64 - ROT[i+s], max64))
+            dec.append('x%d = (x%d - x%d) & 0x%x' % (m, m, n, max64))
+    dec.extend(inject(0, '-'))
+    return enc, dec
+
+def _compile(name, args, body, namespace=None):
+    """Compile a generated function and return it.
+
+    `namespace` holds any globals the generated code refers to.
+
+    Primarily for internal use.
+
+    """
+    namespace = dict(namespace or {})
+    exec('def %s(%s):\n    %s\n' % (name, args, '\n    '.join(body)),
+         namespace)
+    return namespace[name]
+
+def _build_block_functions():
+    """Return generated key expansion, encrypt and decrypt functions.
+
+    Primarily for internal use.
+
+    """
+    expand = ['k0, k1, k2, k3, k4, k5, k6, k7, k8 = key',
+              't0, t1, t2 = tweak',
+              'return (%s)' % ', '.join(
+                  y < 5 and _inline_subkey(s, y) or
+                  '%s & 0x%x' % (_inline_subkey(s, y), max64)
+                  for s in xrange(19) for y in xrange(8))]
+    head = ['x0, x1, x2, x3, x4, x5, x6, x7 = block']
+    tail = ['return [x0, x1, x2, x3, x4, x5, x6, x7]']
+    enc, dec = _round_lines(_scheduled_subkey)
+    return (_compile('_expand_key', 'key, tweak', expand),
+            _compile('_encrypt_block', 'ks, block', head + enc + tail),
+            _compile('_decrypt_block', 'ks, block', head + dec + tail))
+
+_built = []
+
+def _block_functions():
+    """Return generated key expansion, encrypt and decrypt functions.
+
+    They take a while to generate, and plain Skein hashing never needs
+    them, so this is only done the first time they are asked for.
+
+    Primarily for internal use.
+
+    """
+    if not _built:
+        _built.extend(_build_block_functions())
+    return _built
+
+def _build_ubi():
+    """Return a generated function for chaining Skein UBI blocks.
+
+    Primarily for internal use.
+
+    """
+    state = ', '.join('x%d' % y for y in xrange(8))
+    msg = ', '.join('m%d' % y for y in xrange(8))
+    chain = ', '.join('k%d' % y for y in xrange(8))
+    enc = _round_lines(_inline_subkey)[0]
+    body = (['%s = key[:8]' % chain,
+             't0, t1 = tweak[:2]',
+             'for i in xrange(0, len(data), 64):',
+             '    %s = unpack_from(data, i)' % msg,
+             '    t0 = (t0 + byte_count_add) & 0x%x' % max64,
+             '    t2 = t0 ^ t1',
+             '    k8 = %s ^ 0x%x' % (' ^ '.join('k%d' % y for y in xrange(8)),
+                                     SKEIN_KS_PARITY),
+             '    %s = %s' % (state, msg)] +
+            ['    ' + line for line in enc] +
+            ['    k%d = x%d ^ m%d' % (y, y, y) for y in xrange(8)] +
+            # set second tweak value to ~SKEIN_T1_FLAG_FIRST:
+            ['    t1 &= 0xbfffffffffffffff',
+             'return [%s], [t0, t1]' % chain])
+    return _compile('ubi', 'key, tweak, data, byte_count_add', body,
+                    {'unpack_from': words_format[8].unpack_from,
+                     'xrange': xrange})
+
+ubi = _build_ubi()
+ubi.__doc__ = """Return chaining value and tweak after hashing `data`.
+
+    This is the Skein UBI chaining step: every 64-byte block of `data`
+    is encrypted with Threefish, keyed with the chaining value `key` (8
+    words) and `tweak` (2 words), and fed forward into the next
+    chaining value. The tweak position is advanced by `byte_count_add`
+    for each block. All state is kept in local variables until the
+    whole run of blocks is done.
+
+    `data` may be any object supporting the buffer protocol, and its
+    length must be a multiple of 64.
+
+    Primarily for internal use.
+
+    """
+
+class KeySchedule(object):
+    """Precomputed subkeys for the Threefish 512-bit block cipher.
+
+    `subkeys` holds all 19 subkeys as a flat tuple of 152 words, with
+    the tweak and round counter already added, so that they can be
+    reused for every block processed under the same key and tweak.
+
+    `key` must be a list of 9 64-bit words and `tweak` a list of 3,
+    as prepared by ``Threefish512``.
+
+    """
+    __slots__ = ('subkeys',)
+
+    def __init__(self, key, tweak):
+        self.subkeys = _block_functions()[0](key[:9], tweak[:3])
+
 class Threefish512(object):
     """The Threefish 512-bit block cipher.
 
@@ -60,43 +220,86 @@ class Threefish512(object):
     ``key`` properties. When choosing the latter, be sure to call
     the ``prepare_key`` and ``prepare_tweak`` methods.
 
+    The key (9 words, including the parity word added by
+    ``prepare_key``) and tweak (3 words) are kept in fixed arrays that
+    are overwritten in place whenever a new key or tweak is set.
+
+    The subkeys derived from the key and tweak are kept in a
+    ``KeySchedule``, which is computed when first needed and reused
+    until ``prepare_key`` or ``prepare_tweak`` is called again.
+
     """
+    __slots__ = ('_key', '_tweak', '_schedule')
+
     def __init__(self, key=None, tweak=None):
         """Set key and tweak.
 
-        The key and the tweak will be lists of 8 64-bit words
-        converted from `key` and `tweak` bytestrings, or all
-        zeroes if not specified.
+        The key and the tweak will be 64-bit words converted from
+        `key` and `tweak` bytestrings, or all zeroes if not specified.
 
         """
+        self._key = word_array(zero_words + [0])
+        self._tweak = word_array(zero_words[:3])
+        self._schedule = None
         if key:
             self.key = bytes2words(key)
             self.prepare_key()
-        else:
-            self.key = words(zero_words[:] + [0])
         if tweak:
             self.tweak = bytes2words(tweak, 2)
             self.prepare_tweak()
-        else:
-            self.tweak = zero_words[:3]
+
+    def _get_key(self):
+        return self._key
+
+    def _set_key(self, key):
+        if len(key) > 9:
+            raise ValueError("a Threefish512 key has at most 9 words")
+        self._key[:len(key)] = word_array(key)
+        self._schedule = None
+
+    key = property(_get_key, _set_key, doc="""The key words.
+
+        Setting it copies up to 9 words into place; more raise
+        ``ValueError``.""")
+
+    def _get_tweak(self):
+        return self._tweak
+
+    def _set_tweak(self, tweak):
+        if len(tweak) > 3:
+            raise ValueError("a Threefish512 tweak has at most 3 words")
+        self._tweak[:len(tweak)] = word_array(tweak)
+        self._schedule = None
+
+    tweak = property(_get_tweak, _set_tweak, doc="""The tweak words.
+
+        Setting it copies up to 3 words into place; more raise
+        ``ValueError``.""")
+
+    def copy(self):
+        """Return a copy of the cipher, with its own key and tweak."""
+        other = Threefish512.__new__(Threefish512)
+        other._key = self._key[:]
+        other._tweak = self._tweak[:]
+        other._schedule = self._schedule # never modified, so shared
+        return other
 
     def prepare_key(self):
         """Compute key."""
-        final = reduce(xor, self.key[:8]) ^ SKEIN_KS_PARITY
-        try:
-            self.key[8] = final
-        except IndexError:
-            #self.key.append(final)
-            self.key = words(list(self.key) + [final])
+        self._key[8] = reduce(xor, self._key[:8]) ^ SKEIN_KS_PARITY
+        self._schedule = None
 
     def prepare_tweak(self):
         """Compute tweak."""
-        final =  self.tweak[0] ^ self.tweak[1]
-        try:
-            self.tweak[2] = final
-        except IndexError:
-            #self.tweak.append(final)
-            self.tweak = words(list(self.tweak) + [final])
+        self._tweak[2] = self._tweak[0] ^ self._tweak[1]
+        self._schedule = None
+
+    @property
+    def schedule(self):
+        """The ``KeySchedule`` for the current key and tweak."""
+        if self._schedule is None:
+            self._schedule = KeySchedule(self.key, self.tweak)
+        return self._schedule
 
     def encrypt_block(self, plaintext):
         """Return 8-word ciphertext, encrypted from plaintext.
@@ -104,33 +307,8 @@ class Threefish512(object):
         `plaintext` must be a list of 8 64-bit words.
 
         """
-        key = self.key
-        tweak = self.tweak
-        state = words(list(imap(add64, plaintext, key[:8])))
-        state[5] = add64(state[5], tweak[0])
-        state[6] = add64(state[6], tweak[1])
-
-        for r,s in izip(xrange(1,19),cycle((0,16))):
-            for i in xrange(16):
-                m,n = PERM[i]
-                state[m] = add64(state[m], state[n])
-                state[n] = RotL_64(state[n], ROT[i+s])
-                state[n] = state[n] ^ state[m]
-            for y in xrange(8):
-                     state[y] = add64(state[y], key[(r+y) % 9])
-            state[5] = add64(state[5], tweak[r % 3])
-            state[6] = add64(state[6], tweak[(r+1) % 3])
-            state[7] = add64(state[7], r)
-
-        return state
-
-    def _feed_forward(self, state, plaintext):
-        """Compute additional step required when hashing.
-        
-        Primarily for internal use.
-
-        """
-        state[:] = list(imap(xor, state, plaintext))
+        return get_backend('single').encrypt_block(self.schedule.subkeys,
+                                                   plaintext)
 
     def decrypt_block(self, ciphertext):
         """Return 8-word plaintext, decrypted from plaintext.
@@ -138,23 +316,52 @@ class Threefish512(object):
         `ciphertext` must be a list of 8 64-bit words.
 
         """
-        key = self.key
-        tweak = self.tweak
-        state = ciphertext[:]
-
-        for r,s in izip(xrange(18,0,-1),cycle((16,0))):
-            for y in xrange(8):
-                 state[y] = sub64(state[y], key[(r+y) % 9])
-            state[5] = sub64(state[5], tweak[r % 3])
-            state[6] = sub64(state[6], tweak[(r+1) % 3])
-            state[7] = sub64(state[7], r)
-
-            for i in xrange(15,-1,-1):
-                m,n = PERM[i]
-                state[n] = RotR_64(state[m] ^ state[n], ROT[i+s])
-                state[m] = sub64(state[m], state[n])
-        
-        result = list(imap(sub64, state, key))
-        result[5] = sub64(result[5], tweak[0])
-        result[6] = sub64(result[6], tweak[1])
-        return result
+        return get_backend('single').decrypt_block(self.schedule.subkeys,
+                                                   ciphertext)
+
+    def _batch_subkeys(self, key, tweak):
+        """Return subkeys for the NumPy batch functions.
+
+        Primarily for internal use.
+
+        """
+        from . import util_numpy
+        if key is None and tweak is None:
+            return util_numpy.np.array(self.schedule.subkeys,
+                                       dtype=util_numpy.np.uint64)
+        if key is None:
+            key = self.key[:8]
+        if tweak is None:
+            tweak = self.tweak[:2]
+        return util_numpy.expand_key(key, tweak)
+
+    def encrypt_blocks(self, plaintext, key=None, tweak=None):
+        """Return a ``(N, 8)`` NumPy array of encrypted blocks.
+
+        `plaintext` must be a ``(N, 8)`` array of 64-bit words (a
+        NumPy ``uint64`` array, or anything convertible to one) holding
+        N independent blocks, which are all encrypted together using
+        vectorized NumPy operations.
+
+        By default every block uses this cipher's key and tweak. A
+        different `key` (8 words) and/or `tweak` (2 words) may be
+        given, either shared by all blocks or as ``(N, 8)`` and
+        ``(N, 2)`` arrays with one row per block.
+
+        Requires NumPy.
+
+        """
+        from .util_numpy import encrypt_blocks
+        return encrypt_blocks(plaintext, self._batch_subkeys(key, tweak))
+
+    def decrypt_blocks(self, ciphertext, key=None, tweak=None):
+        """Return a ``(N, 8)`` NumPy array of decrypted blocks.
+
+        The counterpart of ``encrypt_blocks``, taking the same
+        arguments.
+
+        Requires NumPy.
+
+        """
+        from .util_numpy import decrypt_blocks
+        return decrypt_blocks(ciphertext, self._batch_subkeys(key, tweak))
@@ -17,6 +17,8 @@
 
 """Various helper functions for handling arrays, etc."""
 
+import array
+import binascii
 import struct
 from operator import xor
 
@@ -43,6 +45,17 @@ SKEIN_KS_PARITY = 0x1BD11BDAA9FC1A22
 zero_bytes = struct.pack('64B', *[0] * 64)
 zero_words = [0] * 8
 
+# Compact storage for a fixed number of 64-bit words, updated in place.
+# Python 2 has no 'Q' arrays, so a list has to do there.
+try:
+    array.array('Q')
+except ValueError:
+    word_array = list
+else:
+    def word_array(data):
+        """Return an ``array('Q')`` holding the 64-bit words in `data`."""
+        return array.array('Q', data)
+
 # Build structs for conversion appropriate to this system, favoring
 # native formats if possible for slight performance benefit
 words_format_tpl = "%dQ"
@@ -93,4 +106,9 @@ def sub64(a,b):
     """Return a 64-bit integer difference of `a` and `b`."""
     return (a - b) & max64
 
-
+def xor_bytes(a, b):
+    """Return the bytewise XOR of bytestrings `a` and `b` (same length)."""
+    if not a:
+        return a
+    value = int(binascii.hexlify(a), 16) ^ int(binascii.hexlify(b), 16)
+    return binascii.unhexlify('%0*x' % (2 * len(a), value))
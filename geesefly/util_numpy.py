@@ -38,6 +38,9 @@ except:
 
 SKEIN_KS_PARITY = np.uint64(0x1BD11BDAA9FC1A22)
 
+# shift amounts as uint64 so that shifting uint64 arrays stays unsigned
+_SHIFT = [np.uint64(i) for i in xrange(65)]
+
 # zeroed out byte string and list for convenience and performance
 zero_bytes = struct.pack('64B', *[0] * 64)
 zero_words = np.zeros(8, dtype=np.uint64)
@@ -57,6 +60,9 @@ else:
 words_format = dict(
     (i,struct.Struct(words_format_tpl % i)) for i in (1,2,8))
 
+# Threefish words are always little endian, whatever the platform
+block_dtype = np.dtype('<u8')
+
 def bytes2words(data, length=8):
     """Return a list of `length` 64-bit words from `data`.
     
@@ -64,7 +70,7 @@ def bytes2words(data, length=8):
     `length` must be 1, 2, or 8.
 
     """
-    return(np.fromstring(data, dtype=np.uint64))
+    return(np.frombuffer(data, dtype=block_dtype).astype(np.uint64))
 
 def words2bytes(data, length=8):
     """Return a `length` * 8 byte string from `data`.
@@ -74,10 +80,7 @@ def words2bytes(data, length=8):
     `length` must be 1, 2, or 8.
 
     """
-    try:
-        return(data.tostring())
-    except AttributeError:
-        return(np.uint64(data).tostring())
+    return(np.asarray(data, dtype=block_dtype).tobytes())
 
 def RotL_64(x, N):
     """Return `x` rotated left by `N`."""
@@ -99,3 +102,97 @@ def sub64(a,b):
     return(np.subtract(a, b, dtype=np.uint64))
 
 
+
+
+# Index tables for expanding a key and tweak into all 19 subkeys at
+# once: word y of subkey s is key[(s+y) % 9], plus tweak words for y of
+# 5 and 6 (column 3 of the padded tweak is zero) and s itself for y of 7
+_KEY_INDEX = np.array([(s + y) % 9 for s in xrange(19) for y in xrange(8)])
+_TWEAK_INDEX = np.array([{5: s % 3, 6: (s + 1) % 3}.get(y, 3)
+                         for s in xrange(19) for y in xrange(8)])
+_COUNTER = np.array([y == 7 and s or 0
+                     for s in xrange(19) for y in xrange(8)], dtype=np.uint64)
+
+def expand_key(key, tweak):
+    """Return all Threefish 512-bit subkeys for `key` and `tweak`.
+
+    `key` is an array of 8 64-bit words and `tweak` an array of 2,
+    either shared (shapes ``(8,)`` and ``(2,)``) or one per block
+    (shapes ``(N, 8)`` and ``(N, 2)``). The result has shape
+    ``(152,)`` or ``(152, N)``, with the key parity word, tweak and
+    round counter already folded in.
+
+    """
+    key = np.asarray(key, dtype=np.uint64)[..., :8]
+    tweak = np.asarray(tweak, dtype=np.uint64)[..., :2]
+    parity = np.bitwise_xor.reduce(key, axis=-1) ^ SKEIN_KS_PARITY
+    key = np.concatenate((key, parity[..., np.newaxis]), axis=-1)
+    t0, t1 = tweak[..., 0], tweak[..., 1]
+    tweak = np.stack((t0, t1, t0 ^ t1, np.zeros_like(t0)), axis=-1)
+    subkeys = key[..., _KEY_INDEX] + tweak[..., _TWEAK_INDEX] + _COUNTER
+    return subkeys.T
+
+def _columns(blocks):
+    """Return the words of `blocks` as 8 contiguous arrays of N words.
+
+    Primarily for internal use.
+
+    """
+    blocks = np.asarray(blocks, dtype=np.uint64)
+    if blocks.ndim != 2 or blocks.shape[1] != 8:
+        raise ValueError("blocks must have shape (N, 8)")
+    return [column.copy() for column in blocks.T]
+
+def encrypt_blocks(blocks, subkeys):
+    """Return a ``(N, 8)`` array of blocks encrypted with `subkeys`.
+
+    `blocks` is a ``(N, 8)`` array of independent 64-bit word blocks,
+    and `subkeys` comes from ``expand_key``. Every step of the cipher
+    is applied to all N blocks at once.
+
+    """
+    from .threefish import PERM, ROT
+    x = _columns(blocks)
+    tmp = np.empty_like(x[0])
+    for y in xrange(8):
+        x[y] += subkeys[y]
+    for r in xrange(1, 19):
+        s = 16 * ((r - 1) % 2)
+        for i in xrange(16):
+            m, n = PERM[i]
+            xm, xn = x[m], x[n]
+            xm += xn
+            np.left_shift(xn, _SHIFT[ROT[i+s]], out=tmp)
+            xn >>= _SHIFT[64 - ROT[i+s]]
+            xn |= tmp
+            xn ^= xm
+        for y in xrange(8):
+            x[y] += subkeys[r * 8 + y]
+    return np.column_stack(x)
+
+def decrypt_blocks(blocks, subkeys):
+    """Return a ``(N, 8)`` array of blocks decrypted with `subkeys`.
+
+    `blocks` is a ``(N, 8)`` array of independent 64-bit word blocks,
+    and `subkeys` comes from ``expand_key``. Every step of the cipher
+    is applied to all N blocks at once.
+
+    """
+    from .threefish import PERM, ROT
+    x = _columns(blocks)
+    tmp = np.empty_like(x[0])
+    for r in xrange(18, 0, -1):
+        s = 16 * ((r - 1) % 2)
+        for y in xrange(8):
+            x[y] -= subkeys[r * 8 + y]
+        for i in xrange(15, -1, -1):
+            m, n = PERM[i]
+            xm, xn = x[m], x[n]
+            xn ^= xm
+            np.left_shift(xn, _SHIFT[64 - ROT[i+s]], out=tmp)
+            xn >>= _SHIFT[ROT[i+s]]
+            xn |= tmp
+            xm -= xn
+    for y in xrange(8):
+        x[y] -= subkeys[y]
+    return np.column_stack(x)
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# Check the choice of Threefish backends: the GEESEFLY_BACKEND setting,
+# set_backend and calibrate, and the registry of backends. Each setting
+# is tried in a new interpreter, as it is only read once.
+
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+sys.path.insert(0, ROOT)
+
+from geesefly import backends
+
+SYSTEM = '%s %s %s' % (platform.python_implementation(),
+                       platform.python_version(), platform.machine())
+
+DEFAULT_BULK = 'numpy' in backends.available_backends() and 'numpy' or 'swar'
+
+CHOSEN = "import sys\n"\
+         "sys.path.insert(0, %r)\n"\
+         "from geesefly import backends\n"\
+         "try:\n"\
+         "    print(backends.get_backend('single').name + ' ' +\n"\
+         "          backends.get_backend('bulk').name)\n"\
+         "except ValueError as e:\n"\
+         "    print('ValueError ' + str(e))\n" % ROOT
+
+def chosen(setting):
+    """Return the output of CHOSEN run with GEESEFLY_BACKEND=`setting`."""
+    env = dict(os.environ)
+    env['GEESEFLY_BACKEND'] = setting
+    return subprocess.check_output([sys.executable, '-c', CHOSEN],
+                                   env=env).decode('utf-8').strip()
+
+def check(description, passed):
+    sys.stdout.write("    %s... " % description)
+    if passed:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+if __name__ == "__main__":
+    sys.stdout.write("\nChecking GEESEFLY_BACKEND settings:\n")
+    check("Default", chosen('') == 'unrolled ' + DEFAULT_BULK)
+    check("One name for all", chosen('swar') == 'swar swar')
+    check("Unknown name", chosen('bogus') == 'unrolled swar')
+    check("Partial list",
+          chosen('single=int') == 'int ' + DEFAULT_BULK and
+          chosen(' bulk = swar ') == 'unrolled swar')
+    check("Malformed list",
+          all(chosen(setting).startswith('ValueError invalid GEESEFLY_BACKEND')
+              for setting in ('single=int,bulk', 'double=int', 'single=')))
+
+    sys.stdout.write("\nChecking backend registry:\n")
+    def unavailable():
+        raise ImportError("not here")
+    backends.register_backend('unavailable', unavailable)
+    int_backend = backends.load_backend('int')
+    backends.register_backend('custom', lambda: backends.Backend(
+        'custom', int_backend.encrypt_block, int_backend.decrypt_block))
+    names = backends.available_backends()
+    try:
+        backends.load_backend('unavailable')
+    except ImportError:
+        unavailable_raises = True
+    else:
+        unavailable_raises = False
+    try:
+        backends.load_backend('bogus')
+    except KeyError:
+        unknown_raises = True
+    else:
+        unknown_raises = False
+    check("Available backends",
+          'custom' in names and 'unavailable' not in names and
+          unavailable_raises and unknown_raises)
+    subkeys = tuple(range(152))
+    block = list(range(8))
+    data = bytes(bytearray(range(64))) * 4
+    custom = backends.load_backend('custom')
+    check("Looped bulk functions",
+          custom.encrypt_blocks(subkeys, data) ==
+          int_backend.encrypt_blocks(subkeys, data) and
+          custom.decrypt_blocks(subkeys, custom.encrypt_blocks(subkeys, data))
+          == data)
+
+    backends.set_backend('custom', 'single')
+    backends.calibrate(cache=False)
+    check("Calibration keeps set_backend choices",
+          backends.get_backend('single') is custom)
+
+    cache_dir = tempfile.mkdtemp()
+    os.environ['GEESEFLY_CACHE_DIR'] = cache_dir
+    cache_file = os.path.join(cache_dir, 'backends.json')
+    recovered = True
+    for contents in ('[1, 2]', '{"%s": "numpy"}' % SYSTEM, '{"%s": 3}' % SYSTEM,
+                     'not json'):
+        f = open(cache_file, 'w')
+        f.write(contents)
+        f.close()
+        try:
+            choice = backends.calibrate()
+        except Exception:
+            recovered = False
+        else:
+            recovered = recovered and sorted(choice) == ['bulk', 'single']
+    shutil.rmtree(cache_dir)
+    check("Calibration ignores a malformed cache", recovered)
+
+    backends.set_backend(None)
+    check("Return to default choice",
+          backends.get_backend('single').name == 'unrolled')
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 # coding=utf-8
 
+import array
+import copy
 import os
+import pickle
 import struct
 import sys
+import threading
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__),'..'))
 
@@ -27,6 +31,32 @@ test_vectors = {
     '10856f742139000071f48e8ba2a5adb7'.encode(),
 }
 
+# 200 byte message hashed with a leaf size of 128 bytes, fan-out of 2
+# and maximum height of 3
+tree_vector = \
+    'c73b30008032e9e20ba364c82294255a'\
+    '8b1a245c9c5fe781c39b2e050f8f0ae3'\
+    '882cfe696c670204af4933558c4a5d83'\
+    '0ac96133c82ce4d082011c0aee4b30ac'.encode()
+
+# the same, keyed with "spam!"
+keyed_tree_vector = \
+    'dc14bdc319ab491cfbb2ad2b01ae6d66'\
+    'ac6f7a097288dec5ba5f2e03e1c60d9d'\
+    'eb617de5dd25889eaadccc0e519d6785'\
+    '756f53f2133d50fca0e591f3cf9d5278'.encode()
+
+def auth_stream_rejected(data, key, finalize=True):
+    """Return True if AuthDecryptor raises AuthenticationError for `data`."""
+    decryptor = geesefly.AuthDecryptor(key)
+    try:
+        decryptor.update(data)
+        if finalize:
+            decryptor.finalize()
+    except geesefly.AuthenticationError:
+        return True
+    return False
+
 if __name__ == "__main__":
     sys.stdout.write("\nChecking Skein512 test vectors:\n")
     for k,v in test_vectors.items():
@@ -38,16 +68,244 @@ if __name__ == "__main__":
             sys.stdout.write("Fail\n")
             print(digest)
 
+    sys.stdout.write("    Keyed copies... ")
+    mac_key = "spam!".encode()
+    mac = geesefly.Skein512(key=mac_key)
+    for k in test_vectors:
+        copied = mac.copy()
+        copied.update(k)
+        if copied.digest() != geesefly.Skein512(k, key=mac_key).digest():
+            sys.stdout.write("Fail\n")
+            break
+    else:
+        sys.stdout.write("Success\n")
+
+    sys.stdout.write("    Saved and restored state... ")
+    for k, v in test_vectors.items():
+        partial = geesefly.Skein512(k[:40])
+        resumed = geesefly.Skein512()
+        resumed.setstate(partial.getstate())
+        resumed.update(k[40:])
+        if resumed.hexdigest() != v:
+            sys.stdout.write("Fail\n")
+            break
+    else:
+        sys.stdout.write("Success\n")
+
+    from geesefly import backends
+    messages = list(test_vectors.keys()) * 3 + ["".encode()]
+    messages += [bytearray(k) for k in test_vectors.keys()]
+    messages += [memoryview(k) for k in test_vectors.keys()]
+    try:
+        messages += [array.array('I', range(100)),
+                     memoryview(array.array('I', range(40)))]
+    except TypeError: # no buffer interface for arrays in Python 2
+        pass
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        messages.append(numpy.arange(50, dtype=numpy.uint32))
+    expected = [geesefly.Skein512(k).digest() for k in messages]
+    for name in backends.available_backends():
+        sys.stdout.write("    Batch hashing (%s)... " % name)
+        backends.set_backend(name, 'bulk')
+        if geesefly.skein512_many(messages) == expected:
+            sys.stdout.write("Success\n")
+        else:
+            sys.stdout.write("Fail\n")
+    backends.set_backend(None, 'bulk')
+
+    sys.stdout.write("    File hashing... ")
+    f = open(__file__, 'rb')
+    contents = f.read()
+    f.close()
+    if geesefly.hash_file(__file__) == geesefly.Skein512(contents).digest():
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Buffer input... ")
+    buffers = [bytearray(contents), memoryview(contents)]
+    try:
+        import numpy
+    except ImportError:
+        pass
+    else:
+        buffers.append(numpy.frombuffer(contents, dtype=numpy.uint8))
+    if all(geesefly.Skein512(b).digest() == geesefly.Skein512(contents).digest()
+           for b in buffers):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Tree hashing... ")
+    digest = geesefly.Skein512Tree(struct.pack('200B', *range(200)),
+                                   leaf_log=1, fan_out_log=1,
+                                   max_height=3).hexdigest()
+    keyed_digest = geesefly.Skein512Tree(struct.pack('200B', *range(200)),
+                                         key=mac_key, leaf_log=1,
+                                         fan_out_log=1,
+                                         max_height=3).hexdigest()
+    if digest == tree_vector and keyed_digest == keyed_tree_vector:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+        print(digest)
+        print(keyed_digest)
+
+    sys.stdout.write("    Saved and restored tree state... ")
+    message = struct.pack('200B', *range(200))
+    partial = geesefly.Skein512Tree(message[:150], leaf_log=1,
+                                    fan_out_log=1, max_height=3)
+    resumed = geesefly.Skein512Tree(leaf_log=1, fan_out_log=1, max_height=3)
+    resumed.setstate(partial.getstate())
+    resumed.update(message[150:])
+    if resumed.hexdigest() == tree_vector:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Extendable output... ")
+    digest = geesefly.Skein512(contents, digest_bits=8 * 1000).digest()
+    output = geesefly.Skein512(contents, digest_bits=8 * 1000).xof()
+    output.seek(900)
+    tail = output.read(100)
+    output.seek(0)
+    if (output.read(10) + output.read(990) == digest and
+        tail == digest[900:] and output.tell() == 1000):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Extendable output of tree hashes... ")
+    message = struct.pack('200B', *range(200))
+    tree_params = dict(digest_bits=8 * 200, leaf_log=1, fan_out_log=1,
+                       max_height=3)
+    digest = geesefly.Skein512Tree(message, **tree_params).digest()
+    if geesefly.Skein512Tree(message, **tree_params).xof().read(200) == digest:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("\nChecking Threefish512 batch encryption:\n")
+    sys.stdout.write("    Encryption/Decryption of 16 blocks... ")
+    try:
+        import numpy
+    except ImportError:
+        sys.stdout.write("Skipped (NumPy not available)\n")
+    else:
+        tf = geesefly.Threefish512(struct.pack('64B', *range(64)),
+                                   struct.pack('16B', *range(16)))
+        blocks = [[i * 8 + j for j in range(8)] for i in range(16)]
+        result = tf.encrypt_blocks(numpy.array(blocks, dtype=numpy.uint64))
+        if (result.tolist() == [tf.encrypt_block(b) for b in blocks] and
+            tf.decrypt_blocks(result).tolist() == blocks):
+            sys.stdout.write("Success\n")
+        else:
+            sys.stdout.write("Fail\n")
+    sys.stdout.write("    Encryption/Decryption of packed blocks... ")
+    from geesefly import backends
+    tf = geesefly.Threefish512(struct.pack('64B', *range(64)),
+                               struct.pack('16B', *range(16)))
+    blocks = [[i * 8 + j for j in range(8)] for i in range(200)]
+    data = "".encode().join(geesefly.words2bytes(b) for b in blocks)
+    swar = backends.load_backend('swar')
+    result = swar.encrypt_blocks(tf.schedule.subkeys, data)
+    if (result == "".encode().join(geesefly.words2bytes(tf.encrypt_block(b))
+                                   for b in blocks) and
+        swar.decrypt_blocks(tf.schedule.subkeys, result) == data):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Fixed size key and tweak... ")
+    rejected = 0
+    for name, words in (('key', list(range(10))), ('tweak', [1, 2, 3, 4])):
+        try:
+            setattr(tf, name, words)
+        except ValueError:
+            rejected += 1
+    if rejected == 2 and len(tf.key) == 9 and len(tf.tweak) == 3:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
 
     key = "spam!".encode()
     plaintext = "Spam, Spam, Spam, Spam, Spam, Spam, baked beans, Spam, Spam, Spam and Spam!".encode()
     sys.stdout.write("\nChecking geesefly encryption routines:\n")
+    sys.stdout.write("    Star import... ")
+    namespace = {}
+    exec("from geesefly import *", namespace)
+    if all(name in namespace for name in ('encrypt', 'compress_encrypt_auth',
+                                          'AuthEncryptor', 'Skein512', 'new')):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
     sys.stdout.write("    Encryption/Decryption... ")
     result = geesefly.encrypt(plaintext, key)
     if geesefly.encrypt(result, key) == plaintext:
         sys.stdout.write("Success\n")
     else:
         sys.stdout.write("Fail\n")
+    sys.stdout.write("    Streaming Encryption/Decryption... ")
+    encryptor = geesefly.Encryptor(key)
+    result = empty = encryptor.update(plaintext[:50])
+    result += encryptor.update(plaintext[50:]) + encryptor.finalize()
+    decryptor = geesefly.Decryptor(key)
+    decrypted = empty[:0]
+    for i in range(0, len(result), 10):
+        decrypted += decryptor.update(result[i:i+10])
+    if (decrypted + decryptor.finalize() == plaintext and
+        geesefly.encrypt(result, key) == plaintext):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+    sys.stdout.write("    Cipher context Encryption/Decryption... ")
+    cipher = geesefly.Cipher(key)
+    result = cipher.encrypt(plaintext)
+    if (geesefly.encrypt(result, key) == plaintext and
+        cipher.encrypt(result) == plaintext and
+        cipher.encrypt(geesefly.encrypt(plaintext, key)) == plaintext):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+    sys.stdout.write("    Cipher context salts after fork... ")
+    if not hasattr(os, 'fork'):
+        sys.stdout.write("Skipped (no os.fork)\n")
+    else:
+        salts = [cipher.encrypt_ctr(plaintext)[16:32]]
+        for i in range(2):
+            reader, writer = os.pipe()
+            pid = os.fork()
+            if not pid:
+                os.write(writer, cipher.encrypt_ctr(plaintext)[16:32])
+                os._exit(0)
+            os.close(writer)
+            salts.append(os.read(reader, 16))
+            os.close(reader)
+            os.waitpid(pid, 0)
+        salts.append(cipher.encrypt_ctr(plaintext)[16:32])
+        if len(set(salts)) == 4:
+            sys.stdout.write("Success\n")
+        else:
+            sys.stdout.write("Fail\n")
+    sys.stdout.write("    Counter mode Encryption/Decryption... ")
+    result = geesefly.encrypt_ctr(plaintext, key)
+    try:
+        geesefly.decrypt_ctr_range(geesefly.encrypt(plaintext, key), key,
+                                   0, 10)
+    except ValueError:
+        other_format_rejected = True
+    else:
+        other_format_rejected = False
+    if (geesefly.encrypt_ctr(result, key) == plaintext and
+        geesefly.decrypt_ctr_range(result, key, 60, 70) == plaintext[60:70] and
+        other_format_rejected):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
     sys.stdout.write("    Compression/Encryption/Decryption/"\
                      "Authentication... ")
     result = geesefly.compress_encrypt_auth(plaintext, key)
@@ -55,4 +313,146 @@ if __name__ == "__main__":
         sys.stdout.write("Success\n")
     else:
         sys.stdout.write("Fail\n")
+    sys.stdout.write("    Streaming Compression/Encryption/Decryption/"\
+                     "Authentication... ")
+    encryptor = geesefly.AuthEncryptor(key, chunk_size=64)
+    result = encryptor.update(plaintext * 10) + encryptor.finalize()
+    decryptor = geesefly.AuthDecryptor(key)
+    decrypted = decryptor.update(result[:100])
+    decrypted += decryptor.update(result[100:]) + decryptor.finalize()
+    if decrypted == plaintext * 10:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+    sys.stdout.write("    Rejection of altered authenticated streams... ")
+    encryptor = geesefly.AuthEncryptor(key, chunk_size=64)
+    noise = geesefly.Skein512Random(b'seed').getbytes(300)
+    result = encryptor.update(noise) + encryptor.finalize()
+    head, chunks = result[:32], result[32:]
+    size = 4 + 64 + 64 # header, ciphertext and MAC
+    tampered = bytearray(result)
+    tampered[40] ^= 1
+    reordered = head + chunks[size:2*size] + chunks[:size] + chunks[2*size:]
+    oversized = head + struct.pack('>I', (1 << 24) + 64) + chunks[4:]
+    if (len(chunks) > 3 * size and
+        not auth_stream_rejected(result, key) and
+        auth_stream_rejected(bytes(tampered), key) and
+        auth_stream_rejected(reordered, key) and
+        auth_stream_rejected(result[:-size], key) and
+        auth_stream_rejected(result[:-1], key) and
+        auth_stream_rejected(oversized, key, False)):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
 
+    sys.stdout.write("    Random number generation... ")
+    rand = geesefly.Skein512Random(b'seed', pool_size=64)
+    other = geesefly.Skein512Random(b'seed', pool_size=64)
+    values = [rand.randint(1, 6) for i in range(100)]
+    numbers = geesefly.SkeinRandom(b'seed')
+    if (rand.randbits(70) < 2 ** 70 and 0.0 <= rand.random() < 1.0 and
+        set(values) == set(range(1, 7)) and
+        other.fill(bytearray(600))[:64] ==
+        geesefly.Skein512Random(b'seed').getbytes(64) and
+        next(iter(other)) in range(256) and
+        numbers.random() == geesefly.SkeinRandom(b'seed').random()):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+    sys.stdout.write("    Copied random generator... ")
+    rand = geesefly.Skein512Random(b'seed')
+    next(rand)
+    rand.random()
+    copied = rand.copy()
+    if ([next(rand) for i in range(600)] + [rand.random()] ==
+        [next(copied) for i in range(600)] + [copied.random()]):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Saved, copied and pickled random state... ")
+    numbers = geesefly.SkeinRandom(b'seed', pool_size=100)
+    numbers.gauss(0, 1)
+    copies = [copy.copy(numbers), copy.deepcopy(numbers),
+              pickle.loads(pickle.dumps(numbers))]
+    restored = geesefly.SkeinRandom()
+    restored.setstate(numbers.getstate())
+    copies.append(restored)
+    expected = [numbers.gauss(0, 1), numbers.random(),
+                numbers.getrandbits(1000)]
+    if all([c.gauss(0, 1), c.random(), c.getrandbits(1000)] == expected
+           for c in copies):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("    Shared random number generation... ")
+    shared = geesefly.Skein512SharedRandom(b'seed')
+    outputs = [shared.getbytes(16)]
+    threads = [threading.Thread(target=lambda: outputs.append(shared.getbytes(16)))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(set(outputs)) == 5:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+
+    sys.stdout.write("\nChecking hashlib-style objects:\n")
+    family_vectors = {
+        'skein256':
+        '0b98dcd198ea0e50a7a244c444e25c23'\
+        'da30c10fc9a1f270a6637f1f34e67ed2',
+        'skein1024':
+        'e62c05802ea0152407cdd8787fda9e35'\
+        '703de862a4fbc119cff8590afe79250b'\
+        'ccc8b3faf1bd2422ab5c0d263fb2f8af'\
+        'b3f796f048000381531b6f00d85161bc'\
+        '0fff4bef2486b1ebcd3773fabf50ad4a'\
+        'd5639af9040e3f29c6c931301bf79832'\
+        'e9da09857e831e82ef8b4691c2356565'\
+        '15d437d2bda33bcec001c67ffde15ba8',
+    }
+    for name, v in sorted(family_vectors.items()):
+        sys.stdout.write("    %s 1 byte message... " % name)
+        digests = [geesefly.new(name, struct.pack('B', 0xff), pure=pure
+                                ).hexdigest() for pure in (False, True)]
+        if digests == [v, v]:
+            sys.stdout.write("Success\n")
+        else:
+            sys.stdout.write("Fail\n")
+            print(digests)
+
+    sys.stdout.write("    Keyed skein512... ")
+    keyed_vector = \
+        '66393afa5a726d55a0b20036473ce508'\
+        '6927816f6ba7e2263e65962026d72bc5'\
+        'd47d9ee592c4d4092c06fc4460a5ac29'\
+        '56add21c94f1779a5fe0c875372599d5'
+    digests = [geesefly.new('skein512', struct.pack('B', 0xff), key=mac_key,
+                            pure=pure).hexdigest() for pure in (False, True)]
+    if digests == [keyed_vector, keyed_vector]:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+        print(digests)
+
+    sys.stdout.write("    Skein512 compatibility... ")
+    message = struct.pack('200B', *range(200))
+    pure = geesefly.new('skein512-384', message[:100], key=mac_key,
+                        legacy_key=True)
+    copied = pure.copy()
+    pure.digest() # must not change the object
+    copied.update(message[100:])
+    pure.update(message[100:])
+    if (pure.digest() == copied.digest() ==
+            geesefly.new('Skein-512', message, digest_bits=384,
+                         key=mac_key, legacy_key=True).digest() ==
+            geesefly.Skein512(message, 384, key=mac_key).digest() and
+            geesefly.new('skein512', message).digest() ==
+            geesefly.Skein512(message).digest()):
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
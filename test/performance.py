@@ -3,20 +3,166 @@
 
 # This code adapted form the work of Hagen Fürstenau
 
+"""Benchmark the geesefly primitives.
+
+Run without arguments to benchmark with every available backend and
+print a table. ``--json FILE`` also writes the results as JSON (``-``
+for standard output), so that numbers from different releases can be
+compared. ``--backend NAME`` measures only the named backend (see
+``geesefly.backends``), used for every operation.
+"""
+
+import json
 import os
+import platform
+import subprocess
 import sys
 import timeit
 
 sys.path.insert(0, os.path.join(os.path.dirname(__file__),'..'))
 
-COUNT = 2 
-BLOCK_SIZE = 20 # KB
+REPEAT = 5
+BLOCK_SIZE = 20 # KB, as in earlier versions of this script
+
+def benchmarks(backend):
+    """Return a list of (name, bytes per call, statement, setup)."""
+    setup = "import geesefly\n"\
+            "from geesefly import Skein512, Skein512Random, Threefish512\n"\
+            "key = 'Fee, fie, foe'.encode()\n"\
+            "small = chr(0).encode() * 64\n"\
+            "large = chr(0).encode() * %d\n"\
+            "tf = Threefish512(small, small[:16])\n"\
+            "block = [1] * 8\n"\
+            "rand = Skein512Random(key)\n"\
+            "ciphertext = geesefly.encrypt(large, key)\n"\
+            "sealed = geesefly.compress_encrypt_auth(large, key)\n"\
+            % (BLOCK_SIZE * 1024)
+    large = BLOCK_SIZE * 1024
+    tests = [
+        ("Threefish512.encrypt_block", 64, "tf.encrypt_block(block)", setup),
+        ("Threefish512.decrypt_block", 64, "tf.decrypt_block(block)", setup),
+        ("Skein512()", 0, "Skein512()", setup),
+        ("Skein512(key=key)", 0, "Skein512(key=key)", setup),
+        ("Skein512 64 byte message", 64, "Skein512(small).digest()", setup),
+        ("Skein512.update", large, "update(large)",
+         setup + "update = Skein512().update\n"),
+        ("new('skein512') %d KB" % BLOCK_SIZE, large,
+         "geesefly.new('skein512', large).digest()", setup),
+        ("new('skein512', pure=True) %d KB" % BLOCK_SIZE, large,
+         "geesefly.new('skein512', large, pure=True).digest()", setup),
+        ("skein512_many 100 x 64 bytes", 6400,
+         "geesefly.skein512_many([small] * 100)", setup),
+        ("encrypt", large, "geesefly.encrypt(large, key)", setup),
+        ("decrypt", large, "geesefly.encrypt(ciphertext, key)", setup),
+        ("compress_encrypt_auth", large,
+         "geesefly.compress_encrypt_auth(large, key)", setup),
+        ("decompress_decrypt_auth", large,
+         "geesefly.compress_encrypt_auth(sealed, key)", setup),
+        ("Skein512Random.getbytes(16)", 16, "rand.getbytes(16)", setup),
+        ("Skein512Random.getbytes %d KB" % BLOCK_SIZE, large,
+         "rand.getbytes(%d)" % large, setup),
+    ]
+    if backend == 'numpy':
+        tests.append(("Threefish512.encrypt_blocks 1000 blocks", 64000,
+                      "tf.encrypt_blocks(blocks)",
+                      setup + "import numpy\n"
+                      "blocks = numpy.ones((1000, 8), dtype=numpy.uint64)\n"))
+    return tests
+
+def run(backend):
+    """Return a list of result dictionaries for `backend`."""
+    from geesefly import backends
+    backends.set_backend(backend)
+    results = []
+    for name, size, statement, setup in benchmarks(backend):
+        timer = timeit.Timer(statement, setup)
+        number = 1
+        while timer.timeit(number) < 0.2:
+            number *= 2
+        best = min(timer.repeat(number=number, repeat=REPEAT)) / number
+        result = {'name': name, 'backend': backend, 'seconds': best}
+        if size:
+            result['bytes_per_second'] = size / best
+        results.append(result)
+    for result in memory_use():
+        result['backend'] = backend
+        results.append(result)
+    return results
+
+def memory_use(count=50):
+    """Return result dictionaries giving the bytes used per live object."""
+    try:
+        import tracemalloc
+    except ImportError: # Python 2
+        return []
+    import geesefly
+    makers = [
+        ("Threefish512 memory",
+         lambda: geesefly.Threefish512('k'.encode() * 64, 't'.encode() * 16)),
+        ("Skein512 memory", lambda: geesefly.Skein512('x'.encode() * 100)),
+        ("Skein512 keyed copy memory",
+         lambda mac=geesefly.Skein512(key='key'.encode()): mac.copy()),
+    ]
+    results = []
+    for name, make in makers:
+        make()
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        objects = [make() for i in range(count)]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del objects
+        results.append({'name': name, 'bytes_per_object': used // count})
+    return results
+
+def run_separately(backend):
+    """Run the benchmarks for `backend` in a new interpreter."""
+    output = subprocess.check_output([sys.executable, __file__,
+                                      '--backend', backend, '--json', '-'])
+    return json.loads(output.decode('utf-8'))['results']
+
+def main(args):
+    from geesefly.backends import available_backends
+    backends = available_backends()
+    json_file = None
+    while args:
+        option = args.pop(0)
+        if option == '--backend':
+            backends = (args.pop(0),)
+        elif option == '--json':
+            json_file = args.pop(0)
+        else:
+            sys.exit("usage: performance.py [--backend NAME] [--json FILE]")
+
+    if len(backends) == 1:
+        results = run(backends[0])
+    else:
+        results = []
+        for backend in backends:
+            results.extend(run_separately(backend))
+
+    report = {'python': platform.python_version(),
+              'implementation': platform.python_implementation(),
+              'machine': platform.machine(),
+              'results': results}
+    if json_file == '-':
+        json.dump(report, sys.stdout, indent=1, sort_keys=True)
+        return
+    for result in results:
+        if 'bytes_per_object' in result:
+            print("%-42s %-10s %12d bytes" % (result['name'],
+                                              result['backend'],
+                                              result['bytes_per_object']))
+            continue
+        line = "%-42s %-10s %12.2f us" % (result['name'], result['backend'],
+                                          result['seconds'] * 1e6)
+        if 'bytes_per_second' in result:
+            line += " %12d KB/s" % (result['bytes_per_second'] / 1024)
+        print(line)
+    if json_file:
+        f = open(json_file, 'w')
+        json.dump(report, f, indent=1, sort_keys=True)
+        f.close()
 
 if __name__ == "__main__":
-    setup = "from geesefly import Skein512\n"\
-            "update = Skein512().update\n"\
-            "txt = chr(0).encode() * %d\n" % (BLOCK_SIZE*1024)
-    best = min(timeit.Timer("update(txt)", setup).repeat(
-               number=COUNT, repeat=5))
-    print("geesefly.Skein512 hashes %d KB/s on this machine"
-          % (COUNT*BLOCK_SIZE/best))
+    main(sys.argv[1:])
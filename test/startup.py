@@ -0,0 +1,56 @@
+#!/usr/bin/env python
+# coding=utf-8
+
+# Check that "import geesefly" stays cheap: hashing a short message in a
+# new interpreter must not import NumPy or the encryption module, and
+# must not take much longer than starting the interpreter at all.
+
+import os
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# seconds that importing geesefly and hashing may add to startup
+MAX_IMPORT_TIME = 0.15
+
+HASH_ONCE = "import sys\n"\
+            "sys.path.insert(0, %r)\n"\
+            "import geesefly\n"\
+            "geesefly.Skein512('x'.encode()).digest()\n"\
+            "print(' '.join(sorted(sys.modules)))\n" % ROOT
+
+def best_time(source, repeat=5):
+    """Return the best wall time for running `source` in a new interpreter."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        subprocess.check_output([sys.executable, '-c', source])
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+if __name__ == "__main__":
+    sys.stdout.write("\nChecking package startup:\n")
+    modules = subprocess.check_output([sys.executable, '-c', HASH_ONCE]
+                                      ).decode('ascii').split()
+    sys.stdout.write("    Modules imported for one digest... ")
+    unwanted = ['numpy', 'geesefly.util_numpy']
+    if sys.version_info >= (3, 7): # earlier versions cannot import lazily
+        unwanted += ['zlib', 'geesefly.geesefly']
+    unwanted = [name for name in unwanted if name in modules]
+    if not unwanted:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+        print(unwanted)
+
+    sys.stdout.write("    Import time... ")
+    extra = best_time(HASH_ONCE) - best_time("pass")
+    if extra < MAX_IMPORT_TIME:
+        sys.stdout.write("Success\n")
+    else:
+        sys.stdout.write("Fail\n")
+    print("        (%.1f ms to import geesefly and hash)" % (extra * 1000))